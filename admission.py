@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from math import ceil
+from time import perf_counter
+
+from gevent.lock import BoundedSemaphore
+
+from metrics import *
+
+requests_shed = Counter('mrsh_requests_shed_total', 'API calls rejected by admission control.', ('method', 'reason'))
+
+
+class Admission:
+    def __init__(self, name, max_concurrency, max_waiting, max_latency):
+        self.name = name
+        self.slots = BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.max_latency = max_latency
+        self.waiting = 0
+        self.latency = 0
+
+    @property
+    def retry_after(self):
+        return max(1, ceil(self.latency * (self.waiting + 1) / self.max_concurrency))
+
+    def shed(self, reason):
+        requests_shed.inc(self.name, reason)
+        raise Overloaded(self.retry_after)
+
+    @contextmanager
+    def admit(self):
+        if self.slots.locked():
+            if self.waiting >= self.max_waiting:
+                self.shed('queue')
+            if self.max_latency and self.latency > self.max_latency:
+                self.shed('latency')
+        self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=ADMISSION_WAIT_TIMEOUT)
+        finally:
+            self.waiting -= 1
+        if not acquired:
+            self.shed('timeout')
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.latency += (perf_counter() - start - self.latency) * ADMISSION_LATENCY_DECAY
+            self.slots.release()
+
+
+admissions = {}
+
+
+def admit(cls):
+    admission = admissions.get(cls)
+    if admission is None:
+        admission = admissions[cls] = Admission(
+            getattr(cls, 'name', None) or cls.__name__,
+            getattr(cls, 'max_concurrency', ADMISSION_MAX_CONCURRENCY),
+            getattr(cls, 'max_waiting', ADMISSION_MAX_WAITING),
+            getattr(cls, 'max_latency', ADMISSION_MAX_LATENCY),
+        )
+    return admission.admit()
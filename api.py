@@ -1,3 +1,7 @@
+import gevent
+from flask import copy_current_request_context, has_request_context
+
+from admission import *
 from methods import *
 
 
@@ -39,6 +43,15 @@ vers = {
         'get_chat': GetChat_0_0_5,
         'get_chats': GetChats_0_0_5,
         'get_chat_history': GetChatHistory_0_0_5,
+    },
+    '0.0.6': {
+        'get_chat': GetChat_0_0_6,
+        'get_chats': GetChats_0_0_6,
+        'get_chat_history': GetChatHistory_0_0_6,
+        'get_friends': GetFriends_0_0_6,
+        'logout_user': LogoutUser_0_0_6,
+        'search_messages': SearchMessages_0_0_6,
+        'sync': Sync_0_0_6,
     }
 }
 
@@ -46,18 +59,94 @@ vers = {
 websocket_methods = set(filter(None, [subc.name for subc in AuthorizedMethod.__subclasses__()]))
 
 
+def compile_methods():
+    table = {}
+    current = {}
+    for version, methods in vers.items():
+        current.update(methods)
+        for name, cls in current.items():
+            table[version, name] = cls
+    for cls in set(table.values()):
+        if issubclass(cls, Method):
+            cls.compile_schema()
+    return table
+
+
+method_table = compile_methods()
+method_names = {name for _, name in method_table} | {'batch'}
+
+
 def find_method(version, method):
-    versions = list(vers.keys())
-    ind = versions.index(version)
-    for v in reversed(versions[0:ind + 1]):
-        if method in vers[v]:
-            return vers[v][method]
-    raise InvalidMethod
+    try:
+        return method_table[version, method]
+    except (KeyError, TypeError):
+        raise InvalidMethod
 
 
 def api_request(**kwargs):
     v = kwargs.pop('version', LATEST_VERSION)
     if v not in vers:
         raise InvalidVersion
-    method = kwargs.pop('method', None)
-    return find_method(v, method)().process(**kwargs)
+    method = find_method(v, kwargs.pop('method', None))
+    with admit(method):
+        return method().process(**kwargs)
+
+
+def _is_read_only(version, call):
+    try:
+        return find_method(call.get('version', version), call.get('method')).read_only
+    except (InvalidRequest, AttributeError):
+        return False
+
+
+def batch_request(**kwargs):
+    calls = kwargs.get('calls')
+    if not isinstance(calls, list) or not calls:
+        raise BadArgument('calls')
+    if len(calls) > BATCH_MAX_CALLS:
+        raise CustomBadArgument(f'Invalid argument: {{}}. No more than {BATCH_MAX_CALLS} calls are allowed.', 'calls')
+    version = kwargs.get('version', LATEST_VERSION)
+    token = kwargs.get('token')
+    auth = {}
+
+    def authorize():
+        if 'user' not in auth:
+            try:
+                if not token:
+                    raise MissingRequiredArgument('token')
+                auth['user'] = User.authorize_by_token(token)
+            except InvalidRequest as e:
+                auth['user'] = e
+        if isinstance(auth['user'], InvalidRequest):
+            raise auth['user']
+        return auth['user']
+
+    def run(call):
+        try:
+            if not isinstance(call, dict) or not isinstance(call.get('params', {}), dict):
+                raise BadArgumentType('calls')
+            v = call.get('version', version)
+            if v not in vers:
+                raise InvalidVersion
+            method = find_method(v, call.get('method'))
+            params = dict(call.get('params', {}))
+            params.pop('token', None)
+            with admit(method):
+                if issubclass(method, AuthorizedMethod):
+                    res = method().process_as(authorize(), token, **params)
+                else:
+                    res = method().process(**params)
+        except InvalidRequest as e:
+            return {'success': False, 'error': error_response(e)}
+        return {'success': True, 'response': res}
+
+    parallel = Bool('parallel').validate(kwargs.get('parallel'))
+    if parallel and all(_is_read_only(version, call) for call in calls if isinstance(call, dict)):
+        try:
+            authorize()
+        except InvalidRequest:
+            pass
+        greenlets = [gevent.spawn(copy_current_request_context(run) if has_request_context() else run, call) for call in calls]
+        gevent.joinall(greenlets, raise_error=True)
+        return [greenlet.value for greenlet in greenlets]
+    return [run(call) for call in calls]
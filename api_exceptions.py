@@ -179,3 +179,43 @@ class ChatAlreadyExists(BadArgument):
 
     def __init__(self):
         pass
+
+
+class ImageQueueFull(InvalidRequest):
+    code = 24
+    string = 'image_queue_full'
+    message = 'Too many images are being processed right now. Please try again later.'
+
+
+class Overloaded(InvalidRequest):
+    code = 25
+    string = 'overloaded'
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+    @property
+    def message(self):
+        return f'The server is overloaded. Please retry in {self.retry_after} seconds.'
+
+
+class PoolTimeout(Overloaded):
+    code = 26
+    string = 'database_busy'
+
+    @property
+    def message(self):
+        return f'No database connection is available right now. Please retry in {self.retry_after} seconds.'
+
+
+class SyncCursorExpired(InvalidRequest):
+    code = 27
+    string = 'sync_cursor_expired'
+    message = 'Changes since this cursor are no longer retained. Please reload the full state.'
+
+
+def error_response(e):
+    res = {'code': e.code, 'string': e.string, 'message': e.message}
+    if isinstance(e, Overloaded):
+        res['retry_after'] = e.retry_after
+    return res
@@ -0,0 +1,280 @@
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import json
+from random import Random
+from secrets import token_hex
+from time import perf_counter
+
+import gevent
+from flask import Flask
+
+from main import app as blueprint
+from main import *
+
+scenarios = {}
+flask_app = Flask(__name__)
+flask_app.config['BACKGROUND_WORKERS'] = False
+seeded = {}
+
+
+def scenario(func):
+    scenarios[func.__name__] = func
+    return func
+
+
+def create_app():
+    flask_app.register_blueprint(blueprint)
+    socketio.init_app(flask_app)
+    return flask_app
+
+
+def measure(func, iterations):
+    timings = []
+    queries = pool.checkouts
+    for i in range(iterations):
+        start = perf_counter()
+        func(i)
+        timings.append(perf_counter() - start)
+    queries = pool.checkouts - queries
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'throughput': iterations / sum(timings),
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        'queries_per_call': queries / iterations,
+    }
+
+
+def call(method, **kwargs):
+    with flask_app.app_context():
+        return api_request(method=method, **kwargs)
+
+
+def seed(args):
+    if 'sessions' in seeded:
+        return seeded
+    rng = Random(args.seed)
+    run = token_hex(4)
+    password = 'benchmark-password'
+    hashed = hash_string(password).decode('utf-8')
+    users = []
+    chats = {}
+    seeded.update({'run': run, 'user_ids': [], 'chat_ids': []})
+    with pool.connection() as conn, conn.cursor() as cur:
+        for i in range(args.users):
+            email = f'bench-{run}-{i}@example.com'
+            cur.execute('INSERT INTO `users` (first_name, last_name, email, password) VALUES (%s, %s, %s, %s)', ('Bench', 'User', email, hashed))
+            users.append((cur.lastrowid, email))
+            seeded['user_ids'].append(cur.lastrowid)
+            chats[cur.lastrowid] = []
+        user_ids = [user_id for user_id, _ in users]
+        for owner in user_ids:
+            for _ in range(args.chats_per_user):
+                members = {owner} | set(rng.sample(user_ids, min(len(user_ids), args.members_per_chat - 1)))
+                cur.execute('INSERT INTO `chats` (title, private) VALUES (%s, 0)', (f'bench {run}',))
+                chat_id = cur.lastrowid
+                seeded['chat_ids'].append(chat_id)
+                members = list(members)
+                cur.executemany('INSERT INTO `messages` (chat_id, author_id, text) VALUES (%s, %s, %s)',
+                                [(chat_id, rng.choice(members), f'benchmark message {n}') for n in range(args.messages_per_chat)])
+                cur.execute('SELECT MAX(id) AS id FROM `messages` WHERE chat_id=%s', (chat_id,))
+                last_id = cur.fetchone()['id'] or 0
+                cur.executemany('INSERT INTO `members` (chat_id, member_id, last_read) VALUES (%s, %s, %s)',
+                                [(chat_id, member, last_id) for member in members])
+                for member in members:
+                    chats[member].append(chat_id)
+        friendships = set()
+        for user_id in user_ids:
+            for target in rng.sample(user_ids, min(len(user_ids), args.friends_per_user)):
+                if target != user_id:
+                    friendships.add((user_id, target))
+                    if rng.random() < 0.5:
+                        friendships.add((target, user_id))
+        cur.executemany('INSERT INTO `friends` (sender, target) VALUES (%s, %s)', list(friendships))
+    sessions = []
+    for user_id, email in users:
+        sessions.append({'id': user_id, 'email': email, 'token': call('login_user', email=email, password=password)['token'], 'chats': chats[user_id]})
+    seeded.update({'password': password, 'sessions': sessions})
+    return seeded
+
+
+def teardown():
+    if 'run' not in seeded:
+        return
+    read_markers.flush()
+    users = seeded['user_ids'] or [0]
+    chats = seeded['chat_ids'] or [0]
+    user_filler = ', '.join(['%s'] * len(users))
+    chat_filler = ', '.join(['%s'] * len(chats))
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute(f'DELETE FROM `changes` WHERE chat_id IN ({chat_filler}) OR user_id IN ({user_filler})', (*chats, *users))
+        cur.execute(f'DELETE FROM `messages` WHERE chat_id IN ({chat_filler})', chats)
+        cur.execute(f'DELETE FROM `members` WHERE chat_id IN ({chat_filler})', chats)
+        cur.execute(f'DELETE FROM `chats` WHERE id IN ({chat_filler})', chats)
+        cur.execute(f'DELETE FROM `friends` WHERE sender IN ({user_filler}) OR target IN ({user_filler})', (*users, *users))
+        cur.execute(f'DELETE FROM `tokens` WHERE user_id IN ({user_filler})', users)
+        cur.execute(f'DELETE FROM `users` WHERE id IN ({user_filler})', users)
+    seeded.clear()
+
+
+def session(args, i):
+    sessions = seed(args)['sessions']
+    return sessions[i % len(sessions)]
+
+
+@scenario
+def login(args):
+    data = seed(args)
+    return measure(lambda i: call('login_user', email=session(args, i)['email'], password=data['password']), args.iterations)
+
+
+@scenario
+def login_storm(args):
+    data = seed(args)
+    lags = []
+    running = [True]
+
+    def heartbeat():
+        while running[0]:
+            start = perf_counter()
+            gevent.sleep(0.01)
+            lags.append(perf_counter() - start - 0.01)
+
+    ticker = gevent.spawn(heartbeat)
+    gevent.sleep(0.1)
+    start = perf_counter()
+    logins = [gevent.spawn(call, 'login_user', email=session(args, i)['email'], password=data['password']) for i in range(args.iterations)]
+    gevent.joinall(logins)
+    elapsed = perf_counter() - start
+    running[0] = False
+    ticker.join()
+    lags.sort()
+    return {
+        'iterations': args.iterations,
+        'throughput': args.iterations / elapsed,
+        'hub_lag_p50_ms': lags[len(lags) // 2] * 1000,
+        'hub_lag_p99_ms': lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+        'hub_lag_max_ms': lags[-1] * 1000,
+    }
+
+
+@scenario
+def get_chats(args):
+    seed(args)
+    return measure(lambda i: call('get_chats', token=session(args, i)['token']), args.iterations)
+
+
+@scenario
+def get_chat(args):
+    seed(args)
+
+    def _get_chat(i):
+        user = session(args, i)
+        call('get_chat', token=user['token'], peer_id=user['chats'][i % len(user['chats'])])
+
+    return measure(_get_chat, args.iterations)
+
+
+@scenario
+def send_message(args):
+    seed(args)
+
+    def _send_message(i):
+        user = session(args, i)
+        call('send_message', token=user['token'], peer_id=user['chats'][i % len(user['chats'])], message='benchmark message')
+
+    return measure(_send_message, args.iterations)
+
+
+@scenario
+def mark_as_read(args):
+    seed(args)
+    targets = []
+    for i in range(args.iterations):
+        user = session(args, i)
+        chat_id = user['chats'][i % len(user['chats'])]
+        targets.append((user['token'], sql_req('SELECT MAX(id) AS id FROM `messages` WHERE chat_id=%s', chat_id, fetch_one=True)['id']))
+    return measure(lambda i: call('mark_as_read', token=targets[i][0], message_id=targets[i][1]), args.iterations)
+
+
+@scenario
+def get_friends(args):
+    seed(args)
+    return measure(lambda i: call('get_friends', token=session(args, i)['token']), args.iterations)
+
+
+@scenario
+def api_overhead(args):
+    kwargs = {'first_name': 'John', 'last_name': 'Doe', 'email': 'john@example.com', 'password': 'password'}
+
+    def dispatch(i):
+        find_method(LATEST_VERSION, 'register_user')().check_arguments(dict(kwargs))
+
+    return measure(dispatch, args.iterations * 100)
+
+
+@scenario
+def serialize_history(args):
+    import mrsh_json
+    authors = [User({'id': i, 'first_name': 'John', 'last_name': 'Doe', 'screen_name': f'user{i}'}) for i in range(10)]
+    chat = Chat({'id': 1, 'title': 'benchmark', 'private': False, 'last_read': 500})
+    messages = []
+    for i in range(500):
+        message = Message({'id': i, 'chat_id': 1, 'author_id': i % 10, 'text': 'benchmark message', 'datetime': datetime.now()})
+        message.author = authors[i % 10]
+        messages.append(message)
+    payload = {'chat': chat, 'messages': messages}
+    return measure(lambda i: mrsh_json.dumps(payload), args.iterations)
+
+
+def positive(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return value
+
+
+def non_negative(value):
+    value = int(value)
+    if value < 0:
+        raise argparse.ArgumentTypeError('must not be negative')
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the API layer against the configured MySQL database.')
+    parser.add_argument('scenarios', nargs='*', default=list(scenarios))
+    parser.add_argument('--iterations', type=positive, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--users', type=positive, default=20)
+    parser.add_argument('--chats-per-user', type=positive, default=10)
+    parser.add_argument('--members-per-chat', type=positive, default=3)
+    parser.add_argument('--messages-per-chat', type=positive, default=100)
+    parser.add_argument('--friends-per-user', type=non_negative, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    if not dev:
+        parser.error('refusing to seed benchmark data into the production database')
+    unknown = set(args.scenarios) - set(scenarios)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    create_app()
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = scenarios[name](args)
+            if not args.json:
+                print(f'{name}: ' + ', '.join(f'{k}={v:.2f}' if isinstance(v, float) else f'{k}={v}' for k, v in results[name].items()))
+    finally:
+        with flask_app.app_context():
+            teardown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
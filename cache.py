@@ -0,0 +1,89 @@
+import json
+from collections import OrderedDict
+from time import monotonic
+
+_missing = object()
+
+
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _missing)
+        if entry is _missing:
+            self.misses += 1
+            return default
+        value, expires = entry
+        if expires < monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, monotonic() + (ttl or self.ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def discard_where(self, predicate):
+        for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    def __init__(self, url, ttl, prefix='mrsh:cache'):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.redis.get(f'{self.prefix}:{key}')
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.redis.set(f'{self.prefix}:{key}', json.dumps(value, default=str), ex=ttl or self.ttl)
+
+    def pop(self, key):
+        self.redis.delete(f'{self.prefix}:{key}')
+
+
+def create_cache(url, max_size, ttl):
+    if url:
+        return RedisCache(url, ttl)
+    return TTLCache(max_size, ttl)
+
+
+class NullCache:
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def pop(self, key):
+        return None
+
+    def discard_where(self, predicate):
+        pass
+
+    def clear(self):
+        pass
@@ -1,7 +1,8 @@
+import os
 from pathlib import Path
 
 APP_NAME = 'mrsh'
-LATEST_VERSION = '0.0.5'
+LATEST_VERSION = '0.0.6'
 USERCONTENT_PATH = Path('~').expanduser() / 'Documents' / 'Static' / 'usercontent'
 PFP_PATH = USERCONTENT_PATH / 'profile_pictures'
 PFP_URL = 'https://sovamor.co/usercontent/profile_pictures'
@@ -9,3 +10,54 @@ CHAT_IMAGE_PATH = USERCONTENT_PATH / 'chat_images'
 CHAT_IMAGE_URL = 'https://sovamor.co/usercontent/chat_images'
 
 API_URL = f'https://sovamor.co/{APP_NAME}/api'
+
+SQL_POOL_SIZE = 20
+SQL_POOL_TIMEOUT = 5
+SQL_POOL_RECYCLE = 3600
+SQL_POOL_PING_INTERVAL = 30
+
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+
+HASH_WORKERS = 4
+HASH_QUEUE_SIZE = 256
+
+IMAGE_SIZES = (64, 256, 1024)
+IMAGE_FORMATS = ('webp', 'png')
+IMAGE_WORKERS = 2
+IMAGE_QUEUE_SIZE = 8
+IMAGE_QUEUE_TIMEOUT = 10
+
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+
+BATCH_MAX_CALLS = 20
+
+ADMISSION_MAX_CONCURRENCY = 100
+ADMISSION_MAX_WAITING = 200
+ADMISSION_WAIT_TIMEOUT = 5
+ADMISSION_MAX_LATENCY = 2
+ADMISSION_LATENCY_DECAY = 0.2
+
+MEMBERSHIP_CACHE_SIZE = 100000
+MEMBERSHIP_CACHE_TTL = 60
+
+MAIL_DOMAIN_CACHE_SIZE = 10000
+MAIL_DOMAIN_CACHE_TTL = 3600
+MAIL_BATCH_SIZE = 50
+MAIL_MAX_ATTEMPTS = 6
+MAIL_RETRY_DELAY = 30
+MAIL_LOCK_TIMEOUT = 120
+MAIL_POLL_INTERVAL = 10
+
+ENTITY_CACHE_URL = os.getenv('ENTITY_CACHE_URL')
+ENTITY_CACHE_SIZE = 50000
+ENTITY_CACHE_TTL = 300
+ENTITY_CACHE_NEGATIVE_TTL = 30
+
+WEBSOCKET_SUBSCRIBE_RECENT = int(os.getenv('WEBSOCKET_SUBSCRIBE_RECENT', 0)) or None
+
+READ_MARKER_FLUSH_INTERVAL = 2
+
+CHANGES_RETENTION = 30 * 24 * 3600
+CHANGES_PRUNE_INTERVAL = 3600
+CHANGES_PRUNE_BATCH = 10000
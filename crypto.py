@@ -3,12 +3,25 @@ from hashlib import sha256
 
 import bcrypt
 
+from constants import *
+from metrics import *
+from offload import Offload
+
+hashing = Offload(HASH_WORKERS, HASH_QUEUE_SIZE)
+Gauge('mrsh_hash_pending', 'Password and token hashes queued or running off the hub.', lambda: hashing.pending)
+
+
+def _prehash(plain_text):
+    return b64encode(sha256(plain_text.encode('utf-8')).digest())
+
 
 def hash_string(plain_text):
-    pw = b64encode(sha256(plain_text.encode('utf-8')).digest())
-    return bcrypt.hashpw(pw, bcrypt.gensalt())
+    return hashing.run(bcrypt.hashpw, _prehash(plain_text), bcrypt.gensalt())
 
 
 def verify_hashed_string(plain_text, hashed):
-    pw = b64encode(sha256(plain_text.encode('utf-8')).digest())
-    return bcrypt.checkpw(pw, hashed.encode('utf-8'))
+    return hashing.run(bcrypt.checkpw, _prehash(plain_text), hashed.encode('utf-8'))
+
+
+def fast_hash(plain_text):
+    return sha256(plain_text.encode('utf-8')).digest()
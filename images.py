@@ -0,0 +1,71 @@
+from io import BytesIO
+from secrets import token_urlsafe
+
+from PIL import Image, UnidentifiedImageError
+
+from api_exceptions import *
+from metrics import *
+from offload import Offload
+
+rendering = Offload(IMAGE_WORKERS, IMAGE_QUEUE_SIZE, IMAGE_QUEUE_TIMEOUT, ImageQueueFull)
+Gauge('mrsh_image_pending', 'Image renders queued or running off the hub.', lambda: rendering.pending)
+
+
+def identify_image(data):
+    try:
+        image = Image.open(BytesIO(data))
+    except UnidentifiedImageError:
+        raise BadImage
+    return image.format
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        bg = Image.new('RGBA', image.size, 'WHITE')
+        bg.paste(image, None, image)
+        image = bg
+    return image.convert('RGB')
+
+
+def _render(data):
+    largest = IMAGE_SIZES[-1]
+    image = Image.open(BytesIO(data))
+    image.draft('RGB', (largest, largest))
+    image = _flatten(image)
+    image_width, image_height = image.size
+    side = min(image_width, image_height)
+    base = image.resize((largest, largest),
+                        box=((image_width - side) // 2, (image_height - side) // 2, (image_width + side) // 2, (image_height + side) // 2))
+    res = {}
+    for size in IMAGE_SIZES:
+        resized = base if size == largest else base.resize((size, size), Image.LANCZOS)
+        res[size] = {}
+        for fmt in IMAGE_FORMATS:
+            buf = BytesIO()
+            resized.save(buf, fmt.upper())
+            res[size][fmt] = buf.getvalue()
+    return res
+
+
+def render_image(data):
+    try:
+        return rendering.run(_render, data)
+    except (UnidentifiedImageError, OSError):
+        raise BadImage
+
+
+def save_renditions(renditions, path, url):
+    name = token_urlsafe(64)
+    for size, formats in renditions.items():
+        for fmt, data in formats.items():
+            (path / f'{name}_{size}.{fmt}').write_bytes(data)
+    return f'{url}/{name}_{IMAGE_SIZES[-1]}.png'
+
+
+def rendition_urls(url):
+    suffix = f'_{IMAGE_SIZES[-1]}.png'
+    if not url or not url.endswith(suffix):
+        return None
+    base = url[:-len(suffix)]
+    return {size: {fmt: f'{base}_{size}.{fmt}' for fmt in IMAGE_FORMATS} for size in IMAGE_SIZES}
@@ -1,22 +1,108 @@
+import smtplib
+from uuid import uuid4
+
+import gevent
+from gevent.event import Event
 from flask_mail import Mail, Message
 from pyisemail import is_email
 from pyisemail.validators.dns_validator import dns
 
 from api_exceptions import *
+from cache import *
+from sql_utils import *
 
 mail = Mail()
 
+domain_cache = TTLCache(MAIL_DOMAIN_CACHE_SIZE, MAIL_DOMAIN_CACHE_TTL)
+outbox_event = Event()
+worker_id = uuid4().hex
+
+
+def deliverable(target):
+    domain = target.rsplit('@', 1)[-1].lower()
+    res = domain_cache.get(domain)
+    if res is None:
+        try:
+            res = bool(is_email(target, True))
+        except dns.resolver.NoNameservers:
+            res = False
+        domain_cache.set(domain, res)
+    return res
+
 
 def send_email(target, topic, message):
-    try:
-        if not is_email(target, True):
-            raise BadEmail(target)
-    except dns.resolver.NoNameservers:
+    if not is_email(target) or domain_cache.get(target.rsplit('@', 1)[-1].lower()) is False:
         raise BadEmail(target)
-    msg = Message(topic,
-                  sender=('MRSH', "noreply@sovamor.co"),
-                  recipients=[target], body=message)
-    mail.send(msg)
+    sql_insert('email_outbox', recipient=target, subject=topic, body=message)
+    outbox_event.set()
+
+
+def _claim_batch():
+    sql_req('UPDATE `email_outbox` SET locked_by=%s, locked_until=NOW() + INTERVAL %s SECOND '
+            "WHERE status='pending' AND next_attempt_at<=NOW() AND (locked_until IS NULL OR locked_until<NOW()) "
+            'ORDER BY id LIMIT %s', worker_id, MAIL_LOCK_TIMEOUT, MAIL_BATCH_SIZE)
+    return sql_req("SELECT * FROM `email_outbox` WHERE locked_by=%s AND status='pending' AND locked_until>NOW()", worker_id, fetch_all=True)
+
+
+def _mark_sent(email):
+    sql_req("UPDATE `email_outbox` SET status='sent', sent_at=NOW(), locked_by=NULL, locked_until=NULL WHERE id=%s", email.get('id'))
+
+
+def _mark_failed(email, error, retry=True):
+    attempts = email.get('attempts') + 1
+    status = 'pending' if retry and attempts < MAIL_MAX_ATTEMPTS else 'failed'
+    sql_req('UPDATE `email_outbox` SET status=%s, attempts=%s, last_error=%s, locked_by=NULL, locked_until=NULL, '
+            'next_attempt_at=NOW() + INTERVAL %s SECOND WHERE id=%s',
+            status, attempts, str(error)[:255], MAIL_RETRY_DELAY * 2 ** attempts, email.get('id'))
+
+
+def drain_outbox():
+    while True:
+        batch = _claim_batch()
+        if not batch:
+            return
+        pending = []
+        for email in batch:
+            if deliverable(email.get('recipient')):
+                pending.append(email)
+            else:
+                _mark_failed(email, 'Undeliverable address.', retry=False)
+        if not pending:
+            continue
+        handled = set()
+        try:
+            with mail.connect() as conn:
+                for email in pending:
+                    try:
+                        conn.send(Message(email.get('subject'), sender=('MRSH', "noreply@sovamor.co"),
+                                          recipients=[email.get('recipient')], body=email.get('body')))
+                    except smtplib.SMTPRecipientsRefused as e:
+                        _mark_failed(email, e, retry=False)
+                    except smtplib.SMTPException as e:
+                        _mark_failed(email, e)
+                    else:
+                        _mark_sent(email)
+                    handled.add(email.get('id'))
+        except (OSError, smtplib.SMTPException) as e:
+            for email in pending:
+                if email.get('id') not in handled:
+                    _mark_failed(email, e)
+            return
+
+
+def _outbox_worker(app):
+    while True:
+        outbox_event.wait(MAIL_POLL_INTERVAL)
+        outbox_event.clear()
+        with app.app_context():
+            try:
+                drain_outbox()
+            except Exception as e:
+                app.logger.exception(e)
+
+
+def start_outbox_worker(app):
+    return gevent.spawn(_outbox_worker, app)
 
 
 def verification_email(target, vercode):
@@ -1,11 +1,34 @@
-from flask import Blueprint, jsonify
+from functools import partial
+
+from flask import Blueprint, Response, jsonify
 
 from api import *
+from mail import start_outbox_worker
 
 app = Blueprint(APP_NAME, __name__, static_url_path='')
 app.secret_key = secrets['flask_app_secret']
 
 
+def start_background_workers(state):
+    if not state.app.config.get('BACKGROUND_WORKERS', True):
+        return
+    start_outbox_worker(state.app)
+    gevent.spawn(read_markers.run, state.app)
+    read_markers.install_shutdown_flush(state.app)
+    gevent.spawn(run_change_pruner, state.app)
+
+
+app.record_once(start_background_workers)
+
+
+def error_json(e):
+    res = jsonify(success=False, error=error_response(e))
+    if isinstance(e, Overloaded):
+        res.status_code = 503
+        res.headers['Retry-After'] = str(e.retry_after)
+    return res
+
+
 @app.route(f'/{APP_NAME}/api/<method>', methods=['GET', 'POST'])
 def api(method):
     kwargs = dict(request.values)
@@ -14,13 +37,34 @@ def api(method):
     if request.files:
         kwargs.update(request.files)
     try:
-        res = api_request(method=method, **kwargs)
+        with track_request(method if method in method_names else 'unknown', 'http'):
+            res = api_request(method=method, **kwargs)
+    except InvalidRequest as e:
+        return error_json(e)
+    return jsonify(success=True, response=res)
+
+
+@app.route(f'/{APP_NAME}/api/batch', methods=['POST'])
+def batch():
+    kwargs = dict(request.values)
+    if request.json:
+        kwargs.update(request.json)
+    try:
+        with track_request('batch', 'http'):
+            res = batch_request(**kwargs)
     except InvalidRequest as e:
-        return jsonify(success=False, error={'code': e.code, 'string': e.string, 'message': e.message})
+        return error_json(e)
     return jsonify(success=True, response=res)
 
 
+@app.route(f'/{APP_NAME}/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 def websocket_api_callback(method):
+    handler = batch_request if method == 'batch' else partial(api_request, method=method)
+
     def _inner(kwargs=None):
         if kwargs is None:
             kwargs = {}
@@ -28,13 +72,14 @@ def websocket_api_callback(method):
         if 'token' not in kwargs and ' ' in auth:
             kwargs['token'] = auth.split(' ', 1)[1]
         try:
-            res = api_request(method=method, **kwargs)
+            with track_request(method, 'websocket'):
+                res = handler(**kwargs)
         except InvalidRequest as e:
-            return {'success': False, 'error': {'code': e.code, 'string': e.string, 'message': e.message}}
+            return {'success': False, 'error': error_response(e)}
         return {'success': True, 'response': res}
 
     return _inner
 
 
-for _method in websocket_methods:
+for _method in websocket_methods | {'batch'}:
     socketio.on_event(_method, websocket_api_callback(_method))
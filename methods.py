@@ -9,6 +9,10 @@ from websockets import *
 
 class Method(metaclass=ABCMeta):
     name = None
+    read_only = False
+    max_concurrency = ADMISSION_MAX_CONCURRENCY
+    max_waiting = ADMISSION_MAX_WAITING
+    max_latency = ADMISSION_MAX_LATENCY
 
     @property
     def params(self):
@@ -26,14 +30,21 @@ class Method(metaclass=ABCMeta):
         self.check_arguments(kwargs)
         return self._process(**kwargs)
 
+    @classmethod
+    def compile_schema(cls):
+        method = cls.__new__(cls)
+        cls.schema = (tuple(method.params), tuple(method.optional_params))
+        return cls.schema
+
     def check_arguments(self, params):
-        for param in self.params:
+        required, optional = type(self).__dict__.get('schema') or self.compile_schema()
+        for param in required:
             if param.name not in params:
                 raise MissingRequiredArgument(param.name)
-            params[param.name] = param.validate(params[param.name])
-        for param in self.optional_params:
+            params[param.name] = param.validate(params[param.name], self)
+        for param in optional:
             if param.name in params:
-                params[param.name] = param.validate(params[param.name])
+                params[param.name] = param.validate(params[param.name], self)
 
 
 class RegisterUser_0_0_1:
@@ -44,6 +55,7 @@ class RegisterUser_0_0_1:
 class AuthorizedMethod(Method, metaclass=ABCMeta):
     def __init__(self):
         self.user = None
+        self.token = None
 
     @property
     def params(self):
@@ -58,7 +70,11 @@ class AuthorizedMethod(Method, metaclass=ABCMeta):
             token = kwargs.pop('token')
         except KeyError:
             raise MissingRequiredArgument('token')
-        self.user = User.authorize_by_token(token)
+        return self.process_as(User.authorize_by_token(token), token, **kwargs)
+
+    def process_as(self, user, token, /, **kwargs):
+        self.user = user
+        self.token = token
         self.check_arguments(kwargs)
         return self._process(**kwargs)
 
@@ -80,6 +96,8 @@ class CreateChat_0_0_2:
 
 class RegisterUser_0_0_2(Method):
     name = 'register_user'
+    max_concurrency = 8
+    max_waiting = 16
 
     @property
     def params(self):
@@ -135,6 +153,8 @@ class DenyVerification_0_0_2(Method):
 
 class LoginUser_0_0_2(Method):
     name = 'login_user'
+    max_concurrency = 8
+    max_waiting = 32
 
     @property
     def params(self):
@@ -145,7 +165,7 @@ class LoginUser_0_0_2(Method):
         selector = token_hex(32)
         validator = token_hex(64)
         hashed = selector + hash_string(validator).decode('utf-8')
-        sql_insert('tokens', token=hashed, user_id=user_id)
+        sql_insert('tokens', token=hashed, selector=selector, user_id=user_id)
         return selector + validator
 
     def _process(self, **kwargs):
@@ -158,16 +178,15 @@ class LoginUser_0_0_2(Method):
 
 class GetChats_0_0_2(AuthorizedMethod):
     name = 'get_chats'
+    read_only = True
 
     def _process(self, **kwargs):
         res = []
-        chats = self.user.get_chats()
-        for chat in chats:
-            lmsg = chat.get_messages(1)
+        for overview in self.user.get_chats_overview():
             _chat = {
-                **chat.to_dict,
-                'last_message': lmsg[0] if lmsg else None,
-                'members': chat.get_members()
+                **overview['chat'].to_dict,
+                'last_message': overview['last_message'],
+                'members': overview['members']
             }
             res.append(_chat)
         return {
@@ -177,10 +196,11 @@ class GetChats_0_0_2(AuthorizedMethod):
 
 class GetChat_0_0_2(AuthorizedMethod):
     name = 'get_chat'
+    read_only = True
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self)]
+        return [PeerP('peer_id', True)]
 
     @property
     def optional_params(self):
@@ -208,7 +228,7 @@ class CreateChat_0_0_3(AuthorizedMethod):
 
     @property
     def optional_params(self):
-        return [CSSet('user_ids', UserID('user_ids', True, self)), Bool('private')]
+        return [CSSet('user_ids', UserID('user_ids', True)), Bool('private')]
 
     def _process(self, **kwargs):
         user_ids = {self.user.id} | kwargs.get('user_ids', set())
@@ -219,7 +239,7 @@ class CreateChat_0_0_3(AuthorizedMethod):
             if Chat.get_private(user_ids):
                 raise ChatAlreadyExists()
         chat = Chat.create(kwargs.get('title'), private)
-        chat.send_message(self.user.id, f'{self.user.full_name} created "{chat.title}" {"private" if private else "group"} chat')
+        chat.send_message(self.user, f'{self.user.full_name} created "{chat.title}" {"private" if private else "group"} chat')
         for member in user_ids:
             chat.add_member(member)
         return {
@@ -235,19 +255,20 @@ class InviteToChat_0_0_3(AuthorizedMethod):
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self), UserP('user_id', True, self)]
+        return [PeerP('peer_id', True), UserP('user_id', True)]
 
     def _process(self, **kwargs):
         chat = kwargs.get('peer_id')
         target = kwargs.get('user_id')
-        if target.id in chat.members:
+        if chat.is_member(target.id):
             raise CustomBadArgument('{} is already a chat member.', target.full_name)
         chat.add_member(target.id)
-        chat.send_message(self.user.id, f'{self.user.full_name} invited {target.full_name} to the chat.')
+        chat.send_message(self.user, f'{self.user.full_name} invited {target.full_name} to the chat.')
 
 
 class GetUser_0_0_3(AuthorizedMethod):
     name = 'get_user'
+    read_only = True
 
     @property
     def optional_params(self):
@@ -280,7 +301,7 @@ class RemoveFriend_0_0_3(AuthorizedMethod):
 
     @property
     def params(self):
-        return [UserID('user_id', True, self)]
+        return [UserID('user_id', True)]
 
     def _process(self, **kwargs):
         target_id = kwargs.get('user_id')
@@ -295,6 +316,7 @@ class RemoveFriend_0_0_3(AuthorizedMethod):
 
 class GetFriends_0_0_3(AuthorizedMethod):
     name = 'get_friends'
+    read_only = True
 
     @property
     def optional_params(self):
@@ -310,12 +332,12 @@ class SendMessage_0_0_3(AuthorizedMethod):
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self), String('message', True, 4096)]
+        return [PeerP('peer_id', True), String('message', True, 4096)]
 
     def _process(self, **kwargs):
         chat = kwargs.get('peer_id')
         return {
-            'message_id': chat.send_message(self.user.id, kwargs.get('message')).id
+            'message_id': chat.send_message(self.user, kwargs.get('message')).id
         }
 
 
@@ -324,7 +346,7 @@ class MarkAsRead_0_0_3(AuthorizedMethod):
 
     @property
     def params(self):
-        return [MessageP('message_id', True, self)]
+        return [MessageP('message_id', True)]
 
     def _process(self, **kwargs):
         message = kwargs.get('message_id')
@@ -336,11 +358,11 @@ class SendMessage_0_0_4(AuthorizedMethod):
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self), String('message', True, 4096)]
+        return [PeerP('peer_id', True), String('message', True, 4096)]
 
     def _process(self, **kwargs):
         chat = kwargs.get('peer_id')
-        msg = chat.send_message(self.user.id, kwargs.get('message'))
+        msg = chat.send_message(self.user, kwargs.get('message'))
         return {
             'message': msg
         }
@@ -348,6 +370,8 @@ class SendMessage_0_0_4(AuthorizedMethod):
 
 class ResendVerification_0_0_4(Method):
     name = 'resend_verification'
+    max_concurrency = 4
+    max_waiting = 8
 
     @property
     def params(self):
@@ -360,16 +384,15 @@ class ResendVerification_0_0_4(Method):
 
 class GetChats_0_0_4(AuthorizedMethod):
     name = 'get_chats'
+    read_only = True
 
     def _process(self, **kwargs):
         res = []
-        chats = self.user.get_chats()
-        for chat in chats:
-            lmsg = chat.get_messages(1)
+        for overview in self.user.get_chats_overview():
             _chat = {
-                **chat.to_dict,
-                'last_message': lmsg[0] if lmsg else None,
-                'members': chat.get_members()
+                **overview['chat'].to_dict,
+                'last_message': overview['last_message'],
+                'members': overview['members']
             }
             res.append(_chat)
         return {
@@ -379,10 +402,11 @@ class GetChats_0_0_4(AuthorizedMethod):
 
 class GetChatHistory_0_0_4(AuthorizedMethod):
     name = 'get_chat_history'
+    read_only = True
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self)]
+        return [PeerP('peer_id', True)]
 
     @property
     def optional_params(self):
@@ -399,16 +423,16 @@ class GetChatHistory_0_0_4(AuthorizedMethod):
 
 class ChangeProfilePicture_0_0_5(AuthorizedMethod):
     name = 'change_profile_picture'
+    max_concurrency = 4
+    max_waiting = 4
 
     @property
     def params(self):
         return [ProfilePicture('file')]
 
     def _process(self, **kwargs):
-        image = kwargs.get('file')
-        image_name = token_urlsafe(64) + '.png'
-        image.save(PFP_PATH / image_name)
-        self.user.update(profile_picture=f'{PFP_URL}/{image_name}')
+        url = save_renditions(kwargs.get('file'), PFP_PATH, PFP_URL)
+        self.user.update(profile_picture=url)
         return {
             'url': self.user.profile_picture
         }
@@ -423,7 +447,7 @@ class SetSettings_0_0_5(AuthorizedMethod):
 
     @property
     def updateable(self):
-        return [param.name for param in self.optional_params]
+        return {param.name for param in self.schema[1]}
 
     def _process(self, **kwargs):
         filtered = {k: v for k, v in kwargs.items() if k in self.updateable}
@@ -435,17 +459,17 @@ class SetSettings_0_0_5(AuthorizedMethod):
 
 class ChangeChatImage_0_0_5(AuthorizedMethod):
     name = 'change_chat_image'
+    max_concurrency = 4
+    max_waiting = 4
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self), ProfilePicture('file')]
+        return [PeerP('peer_id', True), ProfilePicture('file')]
 
     def _process(self, **kwargs):
-        image = kwargs.get('file')
         chat = kwargs.get('peer_id')
-        image_name = token_urlsafe(64) + '.png'
-        image.save(CHAT_IMAGE_PATH / image_name)
-        chat.update(image=f'{CHAT_IMAGE_URL}/{image_name}')
+        url = save_renditions(kwargs.get('file'), CHAT_IMAGE_PATH, CHAT_IMAGE_URL)
+        chat.update(image=url)
         return {
             'url': chat.image
         }
@@ -453,10 +477,11 @@ class ChangeChatImage_0_0_5(AuthorizedMethod):
 
 class GetChat_0_0_5(AuthorizedMethod):
     name = 'get_chat'
+    read_only = True
 
     @property
     def optional_params(self):
-        return [PeerP('peer_id', True, self), UserP('user_id'), NonNegInt('offset'), NonNegInt('count', 200), Bool('antichronological')]
+        return [PeerP('peer_id', True), UserP('user_id'), NonNegInt('offset'), NonNegInt('count', 200), Bool('antichronological')]
 
     def _process(self, **kwargs):
         chat = kwargs.get('peer_id')
@@ -480,17 +505,16 @@ class GetChat_0_0_5(AuthorizedMethod):
 
 class GetChats_0_0_5(AuthorizedMethod):
     name = 'get_chats'
+    read_only = True
 
     def _process(self, **kwargs):
         res = []
-        chats = self.user.get_chats()
-        for chat in chats:
-            lmsg = chat.get_messages(1)
+        for overview in self.user.get_chats_overview():
             _chat = {
-                **chat.to_dict,
-                'last_message': lmsg[0] if lmsg else None,
-                'members': chat.get_members(),
-                'user_last_read': chat.get_user_last_read(self.user.id),
+                **overview['chat'].to_dict,
+                'last_message': overview['last_message'],
+                'members': overview['members'],
+                'user_last_read': overview['user_last_read'],
             }
             res.append(_chat)
         return {
@@ -500,10 +524,11 @@ class GetChats_0_0_5(AuthorizedMethod):
 
 class GetChatHistory_0_0_5(AuthorizedMethod):
     name = 'get_chat_history'
+    read_only = True
 
     @property
     def params(self):
-        return [PeerP('peer_id', True, self)]
+        return [PeerP('peer_id', True)]
 
     @property
     def optional_params(self):
@@ -519,3 +544,147 @@ class GetChatHistory_0_0_5(AuthorizedMethod):
             },
             'messages': messages,
         }
+
+
+class GetChat_0_0_6(AuthorizedMethod):
+    name = 'get_chat'
+    read_only = True
+
+    @property
+    def optional_params(self):
+        return [PeerP('peer_id', True), UserP('user_id'), NonNegInt('count', 200), NonNegInt('before_id'), NonNegInt('after_id'),
+                Bool('antichronological')]
+
+    def _process(self, **kwargs):
+        chat = kwargs.get('peer_id')
+        user = kwargs.get('user_id')
+        if not chat and not user:
+            raise MissingRequiredArgument('peer_id or user_id should be present.')
+        if not chat:
+            if user.id == self.user.id:
+                raise BadArgument('user_id')
+            chat = Chat.get_private({self.user.id, user.id})
+        messages, next_cursor = chat.get_messages_page(kwargs.get('count'), kwargs.get('before_id'), kwargs.get('after_id'),
+                                                       kwargs.get('antichronological'))
+        read_state = chat.get_user_read_state(self.user.id)
+        return {
+            'chat': {
+                **chat.to_dict,
+                'members': chat.get_members(),
+                'user_last_read': read_state['last_read'],
+                'unread': read_state['unread'],
+            },
+            'messages': messages,
+            'next_cursor': next_cursor,
+        }
+
+
+class GetChatHistory_0_0_6(AuthorizedMethod):
+    name = 'get_chat_history'
+    read_only = True
+
+    @property
+    def params(self):
+        return [PeerP('peer_id', True)]
+
+    @property
+    def optional_params(self):
+        return [NonNegInt('count', 500), NonNegInt('before_id'), NonNegInt('after_id'), Bool('antichronological')]
+
+    def _process(self, **kwargs):
+        chat = kwargs.get('peer_id')
+        messages, next_cursor = chat.get_messages_page(kwargs.get('count'), kwargs.get('before_id'), kwargs.get('after_id'),
+                                                       kwargs.get('antichronological'))
+        read_state = chat.get_user_read_state(self.user.id)
+        return {
+            'chat': {
+                **chat.to_dict,
+                'user_last_read': read_state['last_read'],
+                'unread': read_state['unread'],
+            },
+            'messages': messages,
+            'next_cursor': next_cursor,
+        }
+
+
+class GetChats_0_0_6(AuthorizedMethod):
+    name = 'get_chats'
+    read_only = True
+
+    def _process(self, **kwargs):
+        res = []
+        for overview in self.user.get_chats_overview():
+            _chat = {
+                **overview['chat'].to_dict,
+                'last_message': overview['last_message'],
+                'members': overview['members'],
+                'user_last_read': overview['user_last_read'],
+                'unread': overview['unread'],
+            }
+            res.append(_chat)
+        return {
+            'results': sorted(res, key=lambda _chat: getattr(_chat.get('last_message'), 'datetime', datetime.min), reverse=True)
+        }
+
+
+class SearchMessages_0_0_6(AuthorizedMethod):
+    name = 'search_messages'
+    read_only = True
+    max_concurrency = 8
+    max_waiting = 16
+
+    @property
+    def params(self):
+        return [String('query', True, 256)]
+
+    @property
+    def optional_params(self):
+        return [PeerID('peer_id', True), NonNegInt('count', 100), SearchCursor('cursor')]
+
+    def _process(self, **kwargs):
+        results, next_cursor = self.user.search_messages(kwargs.get('query'), kwargs.get('peer_id'), kwargs.get('count'), kwargs.get('cursor'))
+        return {
+            'results': results,
+            'next_cursor': next_cursor,
+        }
+
+
+class Sync_0_0_6(AuthorizedMethod):
+    name = 'sync'
+    read_only = True
+    max_concurrency = 16
+    max_waiting = 32
+
+    @property
+    def optional_params(self):
+        return [SyncCursor('cursor'), NonNegInt('count', 500)]
+
+    def _process(self, **kwargs):
+        return self.user.sync(kwargs.get('cursor'), kwargs.get('count'))
+
+
+class GetFriends_0_0_6(AuthorizedMethod):
+    name = 'get_friends'
+    read_only = True
+
+    @property
+    def optional_params(self):
+        return [UserP('user_id'), NonNegInt('offset'), NonNegInt('count', 1000)]
+
+    def _process(self, **kwargs):
+        target = kwargs.get('user_id') or self.user
+        return target.get_friends(kwargs.get('count'), kwargs.get('offset'))
+
+
+class LogoutUser_0_0_6(AuthorizedMethod):
+    name = 'logout_user'
+
+    @property
+    def optional_params(self):
+        return [Bool('everywhere')]
+
+    def _process(self, **kwargs):
+        if kwargs.get('everywhere'):
+            self.user.revoke_all_tokens()
+        else:
+            self.user.revoke_token(self.token)
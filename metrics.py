@@ -0,0 +1,138 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, has_app_context
+
+from api_exceptions import *
+
+metrics_registry = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        metrics_registry.append(self)
+
+    def samples(self):
+        return []
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{name}{labels} {value}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels, labels), value) for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, '', self.callback())]
+
+
+class CallbackCounter(Gauge):
+    type = 'counter'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        res = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                res.append((f'{self.name}_bucket', _format_labels(self.labels, labels, f'le="{bound}"'), cumulative))
+            res.append((f'{self.name}_sum', _format_labels(self.labels, labels), total))
+            res.append((f'{self.name}_count', _format_labels(self.labels, labels), count))
+        return res
+
+
+request_latency = Histogram('mrsh_request_duration_seconds', 'API method latency.', ('method', 'transport'))
+request_errors = Counter('mrsh_request_errors_total', 'API method errors by error string.', ('method', 'transport', 'error'))
+request_queries = Histogram('mrsh_request_sql_queries', 'SQL queries issued per API call.', ('method',), COUNT_BUCKETS)
+sql_queries = Counter('mrsh_sql_queries_total', 'SQL queries executed.')
+sql_latency = Histogram('mrsh_sql_query_duration_seconds', 'SQL query latency.')
+emitted_events = Counter('mrsh_websocket_events_emitted_total', 'Websocket events emitted by name.', ('event',))
+
+
+def count_sql_query(duration):
+    sql_queries.inc()
+    sql_latency.observe(duration)
+    if has_app_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+
+
+def current_sql_queries():
+    return g.get('sql_queries', 0) if has_app_context() else 0
+
+
+@contextmanager
+def track_request(method, transport):
+    start = perf_counter()
+    queries = current_sql_queries()
+    try:
+        yield
+    except InvalidRequest as e:
+        request_errors.inc(method, transport, e.string)
+        raise
+    except Exception:
+        request_errors.inc(method, transport, 'internal_error')
+        raise
+    finally:
+        request_latency.observe(perf_counter() - start, method, transport)
+        request_queries.observe(current_sql_queries() - queries, method)
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in metrics_registry) + '\n'
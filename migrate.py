@@ -0,0 +1,178 @@
+import argparse
+import sys
+from pathlib import Path
+from secrets import token_hex, token_urlsafe
+
+from flask import Flask
+
+import objects
+import sql_utils
+from main import app as blueprint
+from main import *
+
+MIGRATIONS_PATH = Path(__file__).parent / 'migrations'
+
+
+def ensure_table():
+    sql_req('CREATE TABLE IF NOT EXISTS `schema_migrations` ('
+            'version VARCHAR(255) NOT NULL PRIMARY KEY, applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)')
+
+
+def applied_versions():
+    ensure_table()
+    return {row.get('version') for row in sql_req('SELECT version FROM `schema_migrations`', fetch_all=True)}
+
+
+def available_migrations():
+    return sorted(MIGRATIONS_PATH.glob('*.sql'))
+
+
+def migrate(args):
+    applied = applied_versions()
+    for path in available_migrations():
+        if path.stem in applied:
+            continue
+        print(f'Applying {path.stem}')
+        for statement in path.read_text().split(';'):
+            if statement.strip():
+                sql_req(statement)
+        sql_insert('schema_migrations', version=path.stem)
+    return 0
+
+
+def status(args):
+    applied = applied_versions()
+    for path in available_migrations():
+        print(f'{"applied" if path.stem in applied else "pending"}  {path.stem}')
+    return 0
+
+
+def exercise_objects(created):
+    tag = created['tag']
+    password = 'check-password'
+    users = []
+    for i in range(2):
+        email = f'check-{tag}-{i}@example.com'
+        code = token_urlsafe()
+        UnverifiedUser.create(first_name='Check', last_name='User', email=email, password=password, verification_code=code)
+        UnverifiedUser.get(email)
+        users.append(UnverifiedUser.verify(code))
+        created['users'].append(users[-1].id)
+    code = token_urlsafe()
+    UnverifiedUser.create(first_name='Check', last_name='User', email=f'check-{tag}-x@example.com', password=password, verification_code=code)
+    UnverifiedUser.delete(code)
+    first, second = users
+    User.authorize(first.email, password)
+    token = LoginUser_0_0_2.add_token(first.id)
+    User.authorize_by_token(token)
+    first.revoke_token(token)
+    first.update(screen_name=f'check{tag}')
+    User.get(screen_name=f'check{tag}')
+    User.screen_name_taken(f'check{tag}')
+    User.get_many([first.id, second.id])
+    Friends(first.id, second.id).create()
+    Friends(second.id, first.id).create()
+    Friends(first.id, second.id).status
+    first.get_friends()
+    first.get_friends(10, 0)
+    Friends(first.id, second.id).delete()
+    chat = Chat.create(f'check {tag}')
+    created['chats'].append(chat.id)
+    chat.send_message(first, f'check {tag} created')
+    chat.add_member(first.id)
+    chat.add_member(second.id)
+    message = chat.send_message(second, f'check {tag} message')
+    Chat.get(chat.id)
+    chat.is_member(first.id)
+    chat.get_members()
+    chat.get_messages()
+    chat.get_messages_page()
+    chat.get_messages_page(before_id=message.id)
+    chat.get_messages_page(after_id=0)
+    chat.get_user_read_state(first.id)
+    chat.get_user_last_read(first.id)
+    first.get_chats()
+    first.get_chats_overview()
+    first.get_chat_ids()
+    first.get_chat_ids(10)
+    Message.get(message.id)
+    message.assess_access(first.id)
+    message.write_read_marker(first.id)
+    first.search_messages('check')
+    first.search_messages('check', chat.id, 10, (1.0, message.id))
+    change_id = int(first.sync()['cursor'].split(':')[1])
+    first.sync((message.id - 1, change_id - 1))
+    prune_changes()
+    try:
+        Chat.get_private({first.id, second.id})
+    except PeerNotFound:
+        pass
+    chat.update(title=f'checked {tag}')
+
+
+def cleanup(created):
+    sql_req('DELETE FROM `unverified_users` WHERE email LIKE %s', f'check-{created["tag"]}-%')
+    users = created['users'] or [0]
+    chats = created['chats'] or [0]
+    user_filler = ', '.join(['%s'] * len(users))
+    chat_filler = ', '.join(['%s'] * len(chats))
+    sql_req(f'DELETE FROM `changes` WHERE chat_id IN ({chat_filler}) OR user_id IN ({user_filler})', *chats, *users)
+    sql_req(f'DELETE FROM `messages` WHERE chat_id IN ({chat_filler})', *chats)
+    sql_req(f'DELETE FROM `members` WHERE chat_id IN ({chat_filler})', *chats)
+    sql_req(f'DELETE FROM `chats` WHERE id IN ({chat_filler})', *chats)
+    sql_req(f'DELETE FROM `friends` WHERE sender IN ({user_filler}) OR target IN ({user_filler})', *users, *users)
+    sql_req(f'DELETE FROM `tokens` WHERE user_id IN ({user_filler})', *users)
+    sql_req(f'DELETE FROM `users` WHERE id IN ({user_filler})', *users)
+
+
+def check(args):
+    if not dev:
+        print('Refusing to run the query check against the production database.')
+        return 1
+    app = Flask(__name__)
+    app.config['BACKGROUND_WORKERS'] = False
+    app.register_blueprint(blueprint)
+    socketio.init_app(app)
+    objects.entity_cache = objects.membership_cache = objects.token_cache = NullCache()
+    queries = {}
+    created = {'tag': token_hex(4), 'users': [], 'chats': []}
+
+    def recording_sql_req(query, *params, **kwargs):
+        queries.setdefault(query, params)
+        return sql_req(query, *params, **kwargs)
+
+    objects.sql_req = sql_utils.sql_req = recording_sql_req
+    try:
+        with app.app_context():
+            exercise_objects(created)
+    finally:
+        objects.sql_req = sql_utils.sql_req = sql_req
+        cleanup(created)
+    failed = 0
+    for query, params in queries.items():
+        if query.lstrip().split(None, 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE'):
+            continue
+        scans = [row for row in sql_req('EXPLAIN ' + query, *params, fetch_all=True)
+                 if row.get('type') == 'ALL' and not row.get('possible_keys') and not str(row.get('table')).startswith('<')]
+        if scans:
+            failed += 1
+            print(f'FULL SCAN on {", ".join(row.get("table") for row in scans)}: {query}')
+        elif args.verbose:
+            print(f'ok: {query}')
+    print(f'{len(queries)} queries recorded, {failed} with full table scans.')
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Applies schema migrations and checks query plans against the configured MySQL database. '
+                                                 'check runs the objects.py flows on a local (non-production) database, records every query '
+                                                 'issued through sql_req and sql_insert, EXPLAINs the SELECT, UPDATE and DELETE statements, '
+                                                 'and deletes the rows it created afterwards.')
+    parser.add_argument('command', choices=['migrate', 'status', 'check'])
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    return {'migrate': migrate, 'status': status, 'check': check}[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+ALTER TABLE users ADD UNIQUE INDEX email (email), ADD INDEX screen_name (screen_name);
+ALTER TABLE unverified_users ADD UNIQUE INDEX verification_code (verification_code), ADD INDEX email (email);
+ALTER TABLE members ADD UNIQUE INDEX chat_id_member_id (chat_id, member_id), ADD INDEX member_id (member_id);
+ALTER TABLE friends ADD UNIQUE INDEX sender_target (sender, target), ADD INDEX target (target);
+ALTER TABLE messages ADD INDEX chat_id_datetime (chat_id, datetime), ADD INDEX author_id (author_id);
+ALTER TABLE tokens ADD INDEX user_id (user_id);
@@ -0,0 +1,3 @@
+ALTER TABLE tokens ADD COLUMN selector CHAR(64) NULL;
+UPDATE tokens SET selector = SUBSTR(token, 1, 64);
+ALTER TABLE tokens MODIFY selector CHAR(64) NOT NULL, ADD UNIQUE INDEX selector (selector);
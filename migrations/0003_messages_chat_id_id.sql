@@ -0,0 +1 @@
+ALTER TABLE messages ADD INDEX chat_id_id (chat_id, id);
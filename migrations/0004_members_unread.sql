@@ -0,0 +1,5 @@
+ALTER TABLE members ADD COLUMN unread INT UNSIGNED NOT NULL DEFAULT 0;
+UPDATE members SET unread = (
+    SELECT COUNT(*) FROM messages
+    WHERE messages.chat_id = members.chat_id AND messages.id > members.last_read AND messages.author_id != members.member_id
+);
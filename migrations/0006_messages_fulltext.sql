@@ -0,0 +1 @@
+ALTER TABLE messages ADD FULLTEXT INDEX text_fulltext (text);
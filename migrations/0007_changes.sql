@@ -0,0 +1,10 @@
+CREATE TABLE changes (
+    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    chat_id INT UNSIGNED NULL,
+    user_id INT UNSIGNED NULL,
+    subject_id INT UNSIGNED NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX chat_id_id (chat_id, id),
+    INDEX user_id_id (user_id, id)
+);
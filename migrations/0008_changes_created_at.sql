@@ -0,0 +1 @@
+CREATE INDEX created_at ON changes (created_at);
@@ -1,11 +1,32 @@
-from flask.json import JSONEncoder
+from datetime import date
 import json as _json
 
+from flask.json import JSONEncoder
+from werkzeug.http import http_date
+
+from objects import User, Chat, Message
+
+encoders = {
+    User: lambda o: o.to_dict,
+    Chat: lambda o: o.to_dict,
+    Message: lambda o: o.to_dict,
+}
+
+
+def _find_encoder(cls):
+    for base in cls.__mro__:
+        if base in encoders:
+            encoders[cls] = encoders[base]
+            return encoders[cls]
+
 
 class MyEncoder(JSONEncoder):
     def default(self, o):
-        if hasattr(o, 'to_dict'):
-            return o.to_dict
+        encoder = encoders.get(type(o)) or _find_encoder(type(o))
+        if encoder:
+            return encoder(o)
+        if isinstance(o, date):
+            return http_date(o)
         return super().default(o)
 
 
@@ -1,9 +1,149 @@
+import atexit
+import re
+import signal
+from datetime import datetime
+from hmac import compare_digest
+
+import gevent
+from flask import g, has_app_context
+
 from api_exceptions import *
+from cache import *
 from crypto import *
+from images import rendition_urls
 from sql_utils import *
 
+MESSAGE_COLUMNS = 'messages.*, users.first_name, users.last_name, users.profile_picture, users.screen_name'
+MESSAGE_AUTHOR_JOIN = 'INNER JOIN users ON messages.author_id = users.id'
+
+token_cache = create_cache(ENTITY_CACHE_URL, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+membership_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+entity_cache = create_cache(ENTITY_CACHE_URL, ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+
+
+def cached_row(key, query, *params):
+    row = entity_cache.get(key)
+    if row is None:
+        row = sql_req(query, *params, fetch_one=True) or False
+        entity_cache.set(key, row, None if row else ENTITY_CACHE_NEGATIVE_TTL)
+    return row
+
+
+class ReadMarkerBuffer:
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, message, user_id):
+        chats = self.pending.setdefault(user_id, {})
+        current = chats.get(message.chat_id)
+        if not current or message.id > current.id:
+            chats[message.chat_id] = message
+
+    def flush(self, user_id=None):
+        if user_id is None:
+            pending, self.pending = self.pending, {}
+        else:
+            pending = {user_id: self.pending.pop(user_id)} if user_id in self.pending else {}
+        error = None
+        for reader, chats in pending.items():
+            for message in chats.values():
+                try:
+                    message.write_read_marker(reader)
+                except Exception as e:
+                    self.add(message, reader)
+                    error = e
+        if error:
+            raise error
+
+    def install_shutdown_flush(self, app):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            gevent.signal_handler(signum, self._shutdown, app, signum, signal.getsignal(signum))
+
+    def _shutdown(self, app, signum, previous):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            app.logger.exception(e)
+        if callable(previous):
+            previous(signum, None)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    def run(self, app):
+        while True:
+            gevent.sleep(READ_MARKER_FLUSH_INTERVAL)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                app.logger.exception(e)
+
+
+read_markers = ReadMarkerBuffer()
+atexit.register(read_markers.flush)
+
+
+def record_change(kind, chat_id=None, user_id=None, subject_id=None):
+    sql_insert('changes', kind=kind, chat_id=chat_id, user_id=user_id, subject_id=subject_id)
+
+
+def prune_changes():
+    while sql_req('DELETE FROM `changes` WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT %s',
+                  CHANGES_RETENTION, CHANGES_PRUNE_BATCH, row_count=True) == CHANGES_PRUNE_BATCH:
+        gevent.sleep(0)
+
+
+def run_change_pruner(app):
+    while True:
+        try:
+            with app.app_context():
+                prune_changes()
+        except Exception as e:
+            app.logger.exception(e)
+        gevent.sleep(CHANGES_PRUNE_INTERVAL)
+
+
+def invalidate_user(user_id, *screen_names):
+    entity_cache.pop(f'user:{user_id}')
+    for screen_name in screen_names:
+        if screen_name:
+            entity_cache.pop(f'screen_name:{screen_name.lower()}')
+
+
+class IdentityMap:
+    def __init__(self):
+        self.users = {}
+        self.full = set()
+
+    @staticmethod
+    def current():
+        if not has_app_context():
+            return None
+        if 'identity_map' not in g:
+            g.identity_map = IdentityMap()
+        return g.identity_map
+
+    def get(self, user_id, full=True):
+        user = self.users.get(user_id)
+        if user and (not full or user_id in self.full):
+            return user
+
+    def add(self, user, full=True):
+        existing = self.users.get(user.id)
+        if not existing:
+            self.users[user.id] = existing = user
+        elif full and user.id not in self.full:
+            for field in User.__slots__:
+                setattr(existing, field, getattr(user, field))
+        if full:
+            self.full.add(user.id)
+        return existing
+
 
 class User:
+    __slots__ = ('id', 'first_name', 'last_name', 'profile_picture', 'screen_name', 'email', 'password')
+
     def __init__(self, payload):
         self.id = payload.get('id')
         self.first_name = payload.get('first_name')
@@ -13,12 +153,61 @@ class User:
         self.email = payload.get('email')
         self.password = payload.get('password')
 
+    @classmethod
+    def from_row(cls, row, full=True):
+        identity_map = IdentityMap.current()
+        if identity_map is None:
+            return cls(row)
+        return identity_map.add(cls(row), full)
+
     @classmethod
     def get(cls, user_id=None, screen_name=None):
-        res = sql_req('SELECT * FROM `users` WHERE ' + ('id=%s' if user_id else 'screen_name=%s'), user_id or screen_name, fetch_one=True)
+        identity_map = IdentityMap.current()
+        if user_id and identity_map:
+            user = identity_map.get(int(user_id))
+            if user:
+                return user
+        if not user_id:
+            key = f'screen_name:{screen_name.lower()}'
+            user_id = entity_cache.get(key)
+            if user_id is None:
+                res = sql_req('SELECT * FROM `users` WHERE screen_name=%s', screen_name, fetch_one=True)
+                entity_cache.set(key, res.get('id') if res else False, None if res else ENTITY_CACHE_NEGATIVE_TTL)
+                if not res:
+                    raise UserNotFound(screen_name)
+                entity_cache.set(f'user:{res.get("id")}', res)
+                return cls.from_row(res)
+            if user_id is False:
+                raise UserNotFound(screen_name)
+        res = cached_row(f'user:{int(user_id)}', 'SELECT * FROM `users` WHERE id=%s', user_id)
         if not res:
             raise UserNotFound(user_id or screen_name)
-        return cls(res)
+        return cls.from_row(res)
+
+    @staticmethod
+    def screen_name_taken(screen_name):
+        return bool(sql_req('SELECT 1 FROM `users` WHERE screen_name=%s', screen_name, fetch_one=True))
+
+    @classmethod
+    def get_many(cls, user_ids):
+        identity_map = IdentityMap.current()
+        res = {}
+        missing = []
+        for user_id in set(user_ids):
+            user = identity_map and identity_map.get(user_id)
+            row = None if user else entity_cache.get(f'user:{user_id}')
+            if user:
+                res[user_id] = user
+            elif row:
+                res[user_id] = cls.from_row(row)
+            elif row is None:
+                missing.append(user_id)
+        if missing:
+            filler = ', '.join(['%s'] * len(missing))
+            for user in sql_req(f'SELECT * FROM `users` WHERE id IN ({filler})', *missing, fetch_all=True):
+                entity_cache.set(f'user:{user.get("id")}', user)
+                res[user.get('id')] = cls.from_row(user)
+        return res
 
     @classmethod
     def authorize(cls, email, password):
@@ -33,11 +222,26 @@ class User:
     @classmethod
     def authorize_by_token(cls, token):
         selector, validator = token[:64], token[64:]
-        res = sql_req('SELECT user_id, token FROM `tokens` WHERE SUBSTR(token, 1, 64)=%s', selector, fetch_one=True)
+        digest = fast_hash(validator).hex()
+        cached = token_cache.get(f'token:{selector}')
+        if cached and compare_digest(cached[1], digest):
+            return cls.get(cached[0])
+        res = sql_req('SELECT user_id, token FROM `tokens` WHERE selector=%s', selector, fetch_one=True)
         if not res or not verify_hashed_string(validator, res.get('token')[64:]):
             raise InvalidTokenError
+        token_cache.set(f'token:{selector}', [res.get('user_id'), digest])
         return cls.get(res.get('user_id'))
 
+    def revoke_token(self, token):
+        sql_req('DELETE FROM `tokens` WHERE selector=%s AND user_id=%s', token[:64], self.id)
+        token_cache.pop(f'token:{token[:64]}')
+
+    def revoke_all_tokens(self):
+        selectors = sql_req('SELECT selector FROM `tokens` WHERE user_id=%s', self.id, fetch_all=True)
+        sql_req('DELETE FROM `tokens` WHERE user_id=%s', self.id)
+        for row in selectors:
+            token_cache.pop(f'token:{row.get("selector")}')
+
     @property
     def to_dict(self):
         return {
@@ -45,24 +249,37 @@ class User:
             'first_name': self.first_name,
             'last_name': self.last_name,
             'profile_picture': self.profile_picture,
+            'profile_picture_renditions': rendition_urls(self.profile_picture),
             'screen_name': self.screen_name,
         }
 
-    def get_friends(self):
-        sent = [el["target"] for el in sql_req('SELECT target FROM `friends` WHERE sender=%s', self.id, fetch_all=True)]
-        received = [el["sender"] for el in sql_req('SELECT sender FROM `friends` WHERE target=%s', self.id, fetch_all=True)]
+    def get_friends(self, count=None, offset=None):
+        query = 'SELECT friend_id, MAX(outgoing) AS outgoing, MAX(incoming) AS incoming FROM (' \
+                'SELECT target AS friend_id, 1 AS outgoing, 0 AS incoming FROM `friends` WHERE sender=%s ' \
+                'UNION ALL ' \
+                'SELECT sender AS friend_id, 0 AS outgoing, 1 AS incoming FROM `friends` WHERE target=%s' \
+                ') f GROUP BY friend_id ORDER BY friend_id'
+        params = [self.id, self.id]
+        if count is not None:
+            query += ' LIMIT %s OFFSET %s'
+            params += [count, offset or 0]
+        friends = sql_req(query, *params, fetch_all=True)
+        users = User.get_many(friend.get('friend_id') for friend in friends)
         res = {
             'mutual': [],
             'incoming': [],
             'outgoing': []
         }
-        for friend in set(sent + received):
-            if friend in sent and friend in received:
-                res['mutual'].append(User.get(friend))
-            elif friend in sent:
-                res['outgoing'].append(User.get(friend))
+        for friend in friends:
+            user = users.get(friend.get('friend_id'))
+            if not user:
+                continue
+            if friend.get('outgoing') and friend.get('incoming'):
+                res['mutual'].append(user)
+            elif friend.get('outgoing'):
+                res['outgoing'].append(user)
             else:
-                res['incoming'].append(User.get(friend))
+                res['incoming'].append(user)
         return res
 
     def get_chats(self):
@@ -71,6 +288,119 @@ class User:
                         'WHERE members.member_id = %s', self.id, fetch_all=True)
         return [Chat(chat) for chat in chats]
 
+    def search_messages(self, query, chat_id=None, count=None, cursor=None):
+        count = count if count is not None else 20
+        sql = f'SELECT {MESSAGE_COLUMNS}, ROUND(MATCH(messages.text) AGAINST (%s IN NATURAL LANGUAGE MODE), 6) AS score FROM messages ' \
+              'INNER JOIN members ON members.chat_id = messages.chat_id AND members.member_id = %s ' \
+              f'{MESSAGE_AUTHOR_JOIN} ' \
+              'WHERE MATCH(messages.text) AGAINST (%s IN NATURAL LANGUAGE MODE) '
+        params = [query, self.id, query]
+        if chat_id is not None:
+            sql += 'AND messages.chat_id = %s '
+            params.append(chat_id)
+        if cursor is not None:
+            sql += 'HAVING score < %s OR (score = %s AND id < %s) '
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql += 'ORDER BY score DESC, messages.id DESC LIMIT %s'
+        res = sql_req(sql, *params, count, fetch_all=True)
+        terms = [re.escape(term) for term in re.findall(r'\w+', query)]
+        pattern = re.compile(rf'\b(?:{"|".join(terms)})\b', re.IGNORECASE) if terms else None
+        results = [{
+            'message': Message.from_row(row),
+            'score': row.get('score'),
+            'highlights': [[match.start(), match.end()] for match in pattern.finditer(row.get('text'))] if pattern else [],
+        } for row in res]
+        next_cursor = f'{res[-1].get("score")}:{res[-1].get("id")}' if res and len(res) == count else None
+        return results, next_cursor
+
+    def sync(self, cursor=None, count=None):
+        count = count if count is not None else 100
+        if count < 1:
+            raise BadArgument('count')
+        read_markers.flush(self.id)
+        if cursor is None:
+            res = sql_req('SELECT (SELECT COALESCE(MAX(id), 0) FROM `messages`) AS message_id, '
+                          '(SELECT COALESCE(MAX(id), 0) FROM `changes`) AS change_id', fetch_one=True)
+            return {'messages': [], 'changes': [], 'read_state': [], 'cursor': f'{res.get("message_id")}:{res.get("change_id")}', 'has_more': False}
+        message_id, change_id = cursor
+        oldest = sql_req('SELECT MIN(id) AS id FROM `changes`', fetch_one=True).get('id')
+        if oldest is not None and change_id < oldest - 1:
+            raise SyncCursorExpired
+        messages = [Message.from_row(row) for row in sql_req(
+            f'SELECT {MESSAGE_COLUMNS} FROM messages '
+            'INNER JOIN members ON members.chat_id = messages.chat_id AND members.member_id = %s '
+            f'{MESSAGE_AUTHOR_JOIN} WHERE messages.id > %s ORDER BY messages.id LIMIT %s', self.id, message_id, count, fetch_all=True)]
+        rows = sql_req('SELECT * FROM `changes` WHERE id > %s AND (user_id = %s OR chat_id IN (SELECT chat_id FROM `members` WHERE member_id = %s)) '
+                       'ORDER BY id LIMIT %s', change_id, self.id, self.id, count, fetch_all=True)
+        statuses = Friends.statuses(self.id, {row.get('subject_id') for row in rows if row.get('kind') == 'friends'})
+        changes = []
+        for row in rows:
+            change = {'id': row.get('id'), 'kind': row.get('kind'), 'chat_id': row.get('chat_id'), 'user_id': row.get('user_id')}
+            if row.get('kind') == 'read':
+                change['last_read'] = row.get('subject_id')
+            elif row.get('kind') == 'chat_updated':
+                try:
+                    change['chat'] = Chat.get(row.get('chat_id'))
+                except PeerNotFound:
+                    continue
+            elif row.get('kind') == 'friends':
+                change['user_id'] = row.get('subject_id')
+                change['status'] = statuses.get(row.get('subject_id'))
+            changes.append(change)
+        chat_ids = {message.chat_id for message in messages} | {row.get('chat_id') for row in rows if row.get('kind') == 'read'}
+        read_state = []
+        if chat_ids:
+            filler = ', '.join(['%s'] * len(chat_ids))
+            read_state = sql_req(f'SELECT chat_id, last_read, unread FROM `members` WHERE member_id=%s AND chat_id IN ({filler})',
+                                 self.id, *chat_ids, fetch_all=True)
+        if messages:
+            message_id = messages[-1].id
+        if rows:
+            change_id = rows[-1].get('id')
+        return {
+            'messages': messages,
+            'changes': changes,
+            'read_state': read_state,
+            'cursor': f'{message_id}:{change_id}',
+            'has_more': len(messages) == count or len(rows) == count,
+        }
+
+    def get_chat_ids(self, recent=None):
+        if not recent:
+            res = sql_req('SELECT chat_id FROM `members` WHERE member_id=%s', self.id, fetch_all=True)
+        else:
+            res = sql_req('SELECT chat_id FROM `members` WHERE member_id=%s '
+                          'ORDER BY (SELECT MAX(id) FROM `messages` WHERE messages.chat_id = members.chat_id) DESC LIMIT %s',
+                          self.id, recent, fetch_all=True)
+        return [chat.get('chat_id') for chat in res]
+
+    def get_chats_overview(self):
+        read_markers.flush(self.id)
+        chats = sql_req('SELECT chats.*, members.last_read AS user_last_read, members.unread AS user_unread FROM chats '
+                        'INNER JOIN members ON members.chat_id = chats.id '
+                        'WHERE members.member_id = %s', self.id, fetch_all=True)
+        if not chats:
+            return []
+        chat_ids = [chat.get('id') for chat in chats]
+        filler = ', '.join(['%s'] * len(chat_ids))
+        last_messages = sql_req(f'SELECT {MESSAGE_COLUMNS} FROM messages '
+                                'INNER JOIN (SELECT MAX(id) AS id FROM messages '
+                                f'WHERE chat_id IN ({filler}) GROUP BY chat_id) last ON messages.id = last.id '
+                                f'{MESSAGE_AUTHOR_JOIN}', *chat_ids, fetch_all=True)
+        last_messages = {message.get('chat_id'): Message.from_row(message) for message in last_messages}
+        members = {chat_id: [] for chat_id in chat_ids}
+        for member in sql_req('SELECT members.chat_id, users.id, users.first_name, users.last_name, users.profile_picture, users.screen_name FROM `members` '
+                              'INNER JOIN `users` ON member_id=users.id '
+                              f'WHERE chat_id IN ({filler})', *chat_ids, fetch_all=True):
+            members[member.pop('chat_id')].append(User.from_row(member, False))
+        return [{
+            'chat': Chat(chat),
+            'last_message': last_messages.get(chat.get('id')),
+            'members': members[chat.get('id')],
+            'user_last_read': chat.get('user_last_read'),
+            'unread': chat.get('user_unread'),
+        } for chat in chats]
+
     @property
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
@@ -79,11 +409,15 @@ class User:
         from websockets import change_settings
         updates = ','.join([f'{k}=%s' for k in kwargs])
         sql_req(f'UPDATE `users` SET {updates} WHERE id=%s', *kwargs.values(), self.id)
-        vars(self).update(kwargs)
+        invalidate_user(self.id, self.screen_name, kwargs.get('screen_name'))
+        for k, v in kwargs.items():
+            setattr(self, k, v)
         change_settings(self, kwargs)
 
 
 class UnverifiedUser(User):
+    __slots__ = ('verification_code',)
+
     def __init__(self, payload):
         self.verification_code = payload.pop('verification_code')
         super().__init__(payload)
@@ -110,10 +444,9 @@ class UnverifiedUser(User):
 
     def _verify(self):
         sql_req('DELETE FROM `unverified_users` WHERE id=%s', self.id)
-        values = vars(self).copy()
-        values.pop('id')
-        values.pop('verification_code')
+        values = {field: getattr(self, field) for field in User.__slots__ if field != 'id'}
         res = sql_insert('users', last_row_id=True, **values)
+        invalidate_user(res, values.get('screen_name'))
         return User.get(res)
 
     @classmethod
@@ -137,18 +470,50 @@ class Friends:
     def mutual(self):
         return Friends(self.target, self.sender).exists
 
+    @staticmethod
+    def _status(outgoing, incoming):
+        if outgoing and incoming:
+            return 'mutual'
+        if outgoing:
+            return 'outgoing'
+        return 'incoming' if incoming else None
+
+    @property
+    def status(self):
+        return self._status(self.exists, self.mutual)
+
+    @classmethod
+    def statuses(cls, user_id, target_ids):
+        target_ids = list(target_ids)
+        if not target_ids:
+            return {}
+        filler = ', '.join(['%s'] * len(target_ids))
+        res = sql_req(f'SELECT sender, target FROM `friends` WHERE (sender=%s AND target IN ({filler})) OR (target=%s AND sender IN ({filler}))',
+                      user_id, *target_ids, user_id, *target_ids, fetch_all=True)
+        outgoing = {row.get('target') for row in res if row.get('sender') == user_id}
+        incoming = {row.get('sender') for row in res if row.get('target') == user_id}
+        return {target_id: cls._status(target_id in outgoing, target_id in incoming) for target_id in target_ids}
+
+    def record_change(self):
+        record_change('friends', user_id=self.sender, subject_id=self.target)
+        record_change('friends', user_id=self.target, subject_id=self.sender)
+
     def create(self):
         if self.exists:
             raise AlreadyFriends
         sql_insert('friends', sender=self.sender, target=self.target)
+        self.record_change()
         return self.mutual
 
     def delete(self):
-        sql_req('DELETE FROM `friends` WHERE sender=%s AND target=%s', self.sender, self.target)
+        if sql_req('DELETE FROM `friends` WHERE sender=%s AND target=%s', self.sender, self.target, row_count=True):
+            self.record_change()
         return self.mutual
 
 
 class Message:
+    __slots__ = ('id', 'chat_id', 'author_id', 'text', 'datetime', 'author')
+
     def __init__(self, payload):
         self.id = payload.get('id')
         self.chat_id = payload.get('chat_id')
@@ -157,22 +522,52 @@ class Message:
         self.datetime = payload.get('datetime')
         self.author = None
 
+    @classmethod
+    def from_row(cls, row):
+        message = cls(row)
+        message.author = User.from_row({
+            'id': message.author_id,
+            'first_name': row.get('first_name'),
+            'last_name': row.get('last_name'),
+            'profile_picture': row.get('profile_picture'),
+            'screen_name': row.get('screen_name'),
+        }, False)
+        return message
+
     def get_author(self):
-        self.author = User.get(self.author_id)
+        identity_map = IdentityMap.current()
+        self.author = identity_map and identity_map.get(self.author_id, False) or User.get(self.author_id)
 
     @classmethod
     def get(cls, message_id):
-        res = sql_req('SELECT id, chat_id, author_id, text, datetime FROM `messages` WHERE id=%s', message_id, fetch_one=True)
+        res = sql_req('SELECT messages.id, messages.chat_id, messages.author_id, messages.text, messages.datetime, '
+                      'users.first_name, users.last_name, users.profile_picture, users.screen_name FROM `messages` '
+                      'INNER JOIN users ON messages.author_id = users.id '
+                      'WHERE messages.id=%s', message_id, fetch_one=True)
         if not res:
             raise MessageNotFound(message_id)
-        return cls(res)
+        return cls.from_row(res)
 
     def mark_as_read(self, user_id):
+        if READ_MARKER_FLUSH_INTERVAL:
+            read_markers.add(self, user_id)
+        else:
+            self.write_read_marker(user_id)
+
+    def write_read_marker(self, user_id):
+        from websockets import read_message, read_state
+        if not sql_req('UPDATE `members` SET '
+                       'unread=(SELECT COUNT(*) FROM `messages` WHERE chat_id=%s AND id>%s AND author_id!=%s), last_read=%s '
+                       'WHERE member_id=%s AND chat_id=%s AND last_read<%s',
+                       self.chat_id, self.id, user_id, self.id, user_id, self.chat_id, self.id, row_count=True):
+            return
+        record_change('read', self.chat_id, user_id, self.id)
+        unread = sql_req('SELECT unread FROM `members` WHERE chat_id=%s AND member_id=%s', self.chat_id, user_id, fetch_one=True)
+        read_state(user_id, self.chat_id, self.id, unread.get('unread') if unread else 0)
         if self.author_id != user_id:
             sql_req('UPDATE `chats` SET `last_read`=%s WHERE last_read<%s AND id=%s', self.id, self.id, self.chat_id)
-            from websockets import read_message
+            entity_cache.pop(f'chat:{self.chat_id}')
             read_message(self)
-        sql_req('UPDATE `members` SET last_read=%s WHERE member_id=%s AND chat_id=%s AND last_read<%s', self.id, user_id, self.chat_id, self.id)
 
     def assess_access(self, user_id):
         chat = Chat.get(self.chat_id)
@@ -196,6 +591,8 @@ class Message:
 
 
 class Chat:
+    __slots__ = ('id', 'title', 'private', 'image', 'last_read')
+
     def __init__(self, payload):
         self.id = payload.get('id')
         self.title = payload.get('title')
@@ -206,11 +603,12 @@ class Chat:
     @classmethod
     def create(cls, title, private=False):
         res = sql_insert('chats', title=title, private=private, last_row_id=True)
+        entity_cache.pop(f'chat:{res}')
         return cls.get(res)
 
     @classmethod
     def get(cls, _id):
-        res = sql_req('SELECT * FROM `chats` WHERE id=%s', _id, fetch_one=True)
+        res = cached_row(f'chat:{int(_id)}', 'SELECT * FROM `chats` WHERE id=%s', _id)
         if not res:
             raise PeerNotFound(_id)
         return cls(res)
@@ -227,40 +625,49 @@ class Chat:
             raise PeerNotFound(members)
         return cls(res)
 
-    @property
-    def members(self):
-        res = sql_req('SELECT member_id FROM `members` WHERE chat_id=%s', self.id, fetch_all=True)
-        return [member.get('member_id') for member in res]
-
     def get_members(self):
         query = 'SELECT users.id, users.first_name, users.last_name, users.profile_picture, users.screen_name FROM `members` ' \
                 'INNER JOIN `users` ON member_id=users.id ' \
                 'WHERE chat_id=%s'
         res = sql_req(query, self.id, fetch_all=True)
-        return [User(user) for user in res]
+        return [User.from_row(user, False) for user in res]
 
     def get_messages(self, count=None, offset=None, antichronological=None):
         count = count if count is not None else 20
         offset = offset if offset is not None else 0
         antichronological = antichronological if antichronological is not None else True
-        query = 'SELECT messages.*, users.first_name, users.last_name, users.profile_picture, users.screen_name FROM messages ' \
-                'INNER JOIN users ON messages.author_id = users.id ' \
+        query = f'SELECT {MESSAGE_COLUMNS} FROM messages {MESSAGE_AUTHOR_JOIN} ' \
                 f'WHERE messages.chat_id = %s ORDER BY messages.datetime {"DESC" if antichronological else "ASC"} LIMIT %s OFFSET %s'
         res = sql_req(query, self.id, count, offset, fetch_all=True)
-        messages = []
-        for message in res:
-            _message = Message(message)
-            _message.author = User({
-                'id': _message.author_id,
-                'first_name': message.get('first_name'),
-                'last_name': message.get('last_name'),
-                'profile_picture': message.get('profile_picture'),
-                'screen_name': message.get('screen_name'),
-            })
-            messages.append(_message)
-        return messages
+        return [Message.from_row(message) for message in res]
+
+    def get_messages_page(self, count=None, before_id=None, after_id=None, antichronological=None):
+        count = count if count is not None else 20
+        antichronological = antichronological if antichronological is not None else True
+        query = f'SELECT {MESSAGE_COLUMNS} FROM messages {MESSAGE_AUTHOR_JOIN} ' \
+                'WHERE messages.chat_id = %s '
+        if after_id is not None:
+            query += 'AND messages.id > %s ORDER BY messages.id ASC LIMIT %s'
+            res = sql_req(query, self.id, after_id, count, fetch_all=True)
+        elif before_id is not None:
+            query += 'AND messages.id < %s ORDER BY messages.id DESC LIMIT %s'
+            res = sql_req(query, self.id, before_id, count, fetch_all=True)
+        else:
+            query += 'ORDER BY messages.id DESC LIMIT %s'
+            res = sql_req(query, self.id, count, fetch_all=True)
+        messages = [Message.from_row(message) for message in res]
+        next_cursor = messages[-1].id if messages and len(messages) == count else None
+        if antichronological == (after_id is not None):
+            messages.reverse()
+        return messages, next_cursor
+
+    def get_user_read_state(self, user_id):
+        read_markers.flush(user_id)
+        res = sql_req('SELECT last_read, unread FROM `members` WHERE chat_id=%s AND member_id=%s', self.id, user_id, fetch_one=True)
+        return res or {'last_read': 0, 'unread': 0}
 
     def get_user_last_read(self, user_id):
+        read_markers.flush(user_id)
         try:
             return sql_req('SELECT last_read FROM `members` WHERE chat_id=%s AND member_id=%s', self.id, user_id, fetch_one=True).get('last_read', 0)
         except KeyError:
@@ -273,28 +680,45 @@ class Chat:
             'title': self.title,
             'private': self.private,
             'image': self.image,
+            'image_renditions': rendition_urls(self.image),
             'last_read': self.last_read,
         }
 
+    def is_member(self, user_id):
+        if membership_cache.get((self.id, user_id)):
+            return True
+        res = bool(sql_req('SELECT 1 FROM `members` WHERE chat_id=%s AND member_id=%s', self.id, user_id, fetch_one=True))
+        if res:
+            membership_cache.set((self.id, user_id), True)
+        return res
+
     def assess_access(self, user_id):
-        if user_id not in self.members:
+        if not self.is_member(user_id):
             raise PeerNotFound(self.id)
 
     def add_member(self, user_id):
         from websockets import invite_to_chat
         last_message = self.get_messages(1)
         sql_insert('members', chat_id=self.id, member_id=user_id, last_read=last_message[0].id)
+        membership_cache.set((self.id, user_id), True)
+        record_change('member_added', self.id, user_id)
         invite_to_chat(self, user_id, last_message)
 
-    def send_message(self, user_id, text):
+    def send_message(self, user, text):
         from websockets import send_message_to_chat
-        last_id = sql_insert('messages', chat_id=self.id, author_id=user_id, text=text, last_row_id=True)
-        message = Message.get(last_id)
-        message.mark_as_read(user_id)
+        last_id = sql_insert('messages', chat_id=self.id, author_id=user.id, text=text, last_row_id=True)
+        sent = sql_req('SELECT datetime FROM `messages` WHERE id=%s', last_id, fetch_one=True).get('datetime')
+        message = Message({'id': last_id, 'chat_id': self.id, 'author_id': user.id, 'text': text, 'datetime': sent})
+        message.author = user
+        sql_req('UPDATE `members` SET unread=IF(member_id=%s, 0, unread + 1), last_read=IF(member_id=%s AND last_read<%s, %s, last_read) '
+                'WHERE chat_id=%s', user.id, user.id, last_id, last_id, self.id)
         send_message_to_chat(self.id, message)
         return message
 
     def update(self, **kwargs):
         updates = ','.join([f'{k}=%s' for k in kwargs])
         sql_req(f'UPDATE `chats` SET {updates} WHERE id=%s', *kwargs.values(), self.id)
-        vars(self).update(kwargs)
+        entity_cache.pop(f'chat:{self.id}')
+        record_change('chat_updated', self.id)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
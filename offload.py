@@ -0,0 +1,21 @@
+from gevent.lock import BoundedSemaphore
+from gevent.threadpool import ThreadPool
+
+
+class Offload:
+    def __init__(self, workers, queue_size, timeout=None, error=None):
+        self.pool = ThreadPool(workers)
+        self.slots = BoundedSemaphore(queue_size)
+        self.timeout = timeout
+        self.error = error
+        self.pending = 0
+
+    def run(self, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise self.error
+        self.pending += 1
+        try:
+            return self.pool.apply(func, args)
+        finally:
+            self.pending -= 1
+            self.slots.release()
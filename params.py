@@ -1,6 +1,6 @@
-from PIL import Image, UnidentifiedImageError
 from werkzeug.datastructures import FileStorage
 
+from images import *
 from objects import *
 
 
@@ -9,12 +9,13 @@ class Param:
         self.type = _type
         self.name = name
         self.truthy = has_to_be_truthy
+        self.checks = tuple(self.custom_checks)
 
     @property
     def custom_checks(self):
         return []
 
-    def validate(self, value):
+    def validate(self, value, method=None):
         if not isinstance(value, self.type):
             try:
                 value = self.type(value)
@@ -22,7 +23,7 @@ class Param:
                 raise BadArgumentType(self.name)
         elif self.truthy and not value:
             raise BadArgument(self.name)
-        for check in self.custom_checks:
+        for check in self.checks:
             res = check(value)
             if res:
                 value = res
@@ -83,18 +84,22 @@ class Bool(Param):
     def __init__(self, name):
         super().__init__(bool, name, False)
 
-    def validate(self, value):
+    def validate(self, value, method=None):
         if not value or str(value) in ['false', 'False', '0', '']:
             return False
         return True
 
 
 class UserID(Param):
-    def __init__(self, name, friend=False, method=None):
+    def __init__(self, name, friend=False):
         self.friend = friend
-        self.method = method
         super().__init__(str, name, True)
 
+    def validate(self, value, method=None):
+        value = super().validate(value, method)
+        self.friend_check(value, method)
+        return value
+
     @staticmethod
     def lower_check(value):
         return value.lower()
@@ -110,71 +115,69 @@ class UserID(Param):
     def user_check(self, value):
         return self.resolve_user(value).id
 
-    def friend_check(self, value):
-        if not self.friend or self.method.user.id == value:
+    def friend_check(self, value, method):
+        if not self.friend or method.user.id == value:
             return
-        fr = Friends(self.method.user.id, value)
+        fr = Friends(method.user.id, value)
         if not (fr.exists and fr.mutual):
             raise NotFriends
 
     @property
     def custom_checks(self):
-        return [self.lower_check, self.user_check, self.friend_check]
+        return [self.lower_check, self.user_check]
 
 
 class UserP(UserID):
     def user_check(self, value):
         return self.resolve_user(value)
 
-    def friend_check(self, value):
-        super().friend_check(value.id)
+    def friend_check(self, value, method):
+        super().friend_check(value.id, method)
 
 
 class PeerID(Param):
-    def __init__(self, name, assess=False, method=None):
+    def __init__(self, name, assess=False):
         self.assess = assess
-        self.method = method
         super().__init__(int, name, True)
 
-    def peer_check(self, value):
+    def validate(self, value, method=None):
+        value = super().validate(value, method)
+        return self.peer_check(value, method) or value
+
+    def peer_check(self, value, method):
         chat = Chat.get(value)
         if self.assess:
-            chat.assess_access(self.method.user.id)
-
-    @property
-    def custom_checks(self):
-        return [self.peer_check]
+            chat.assess_access(method.user.id)
 
 
 class PeerP(PeerID):
-    def peer_check(self, value):
+    def peer_check(self, value, method):
         chat = Chat.get(value)
         if self.assess:
-            chat.assess_access(self.method.user.id)
+            chat.assess_access(method.user.id)
         return chat
 
 
 class MessageID(Param):
-    def __init__(self, name, assess=False, method=None):
+    def __init__(self, name, assess=False):
         self.assess = assess
-        self.method = method
         super().__init__(int, name, True)
 
-    def message_check(self, value):
+    def validate(self, value, method=None):
+        value = super().validate(value, method)
+        return self.message_check(value, method) or value
+
+    def message_check(self, value, method):
         message = Message.get(value)
         if self.assess:
-            message.assess_access(self.method.user.id)
-
-    @property
-    def custom_checks(self):
-        return [self.message_check]
+            message.assess_access(method.user.id)
 
 
 class MessageP(MessageID):
-    def message_check(self, value):
+    def message_check(self, value, method):
         message = Message.get(value)
         if self.assess:
-            message.assess_access(self.method.user.id)
+            message.assess_access(method.user.id)
         return message
 
 
@@ -185,21 +188,15 @@ class ProfilePicture(Param):
     @staticmethod
     def image_check(value):
         try:
-            return Image.open(value)
-        except (UnidentifiedImageError, AttributeError):
+            data = value.read()
+        except AttributeError:
             raise BadImage
+        identify_image(data)
+        return data
 
     @staticmethod
-    def create_pfp(image):
-        image_width, image_height = image.size
-        side = min(image_width, image_height)
-        resized = image.resize((1024, 1024),
-                               box=((image_width - side) // 2, (image_height - side) // 2, (image_width + side) // 2, (image_height + side) // 2))
-        if resized.mode != 'RGBA':
-            return resized
-        bg = Image.new('RGBA', resized.size, 'WHITE')
-        bg.paste(resized, None, resized)
-        return bg
+    def create_pfp(data):
+        return render_image(data)
 
     @property
     def custom_checks(self):
@@ -224,23 +221,52 @@ class ScreenName(String):
 
     @staticmethod
     def unique_check(value):
-        try:
-            User.get(screen_name=value)
+        if User.screen_name_taken(value):
             raise ScreenNameAlreadyTaken
-        except UserNotFound:
-            pass
 
     @property
     def custom_checks(self):
         return super().custom_checks + [self.numbers_check, self.lower_check, self.user_check, self.unique_check]
 
 
+class SearchCursor(String):
+    def __init__(self, name):
+        super().__init__(name, True, 64)
+
+    def cursor_check(self, value):
+        try:
+            score, message_id = value.split(':')
+            return float(score), int(message_id)
+        except ValueError:
+            raise BadArgument(self.name)
+
+    @property
+    def custom_checks(self):
+        return super().custom_checks + [self.cursor_check]
+
+
+class SyncCursor(String):
+    def __init__(self, name):
+        super().__init__(name, True, 64)
+
+    def cursor_check(self, value):
+        try:
+            message_id, change_id = value.split(':')
+            return int(message_id), int(change_id)
+        except ValueError:
+            raise BadArgument(self.name)
+
+    @property
+    def custom_checks(self):
+        return super().custom_checks + [self.cursor_check]
+
+
 class CSSet:
     def __init__(self, name, param):
         self.name = name
         self.param = param
 
-    def validate(self, value):
+    def validate(self, value, method=None):
         if not isinstance(value, str):
             try:
                 value = str(value)
@@ -250,5 +276,5 @@ class CSSet:
         for part in value.split(','):
             part = part.strip()
             if part:
-                res.add(self.param.validate(part))
+                res.add(self.param.validate(part, method))
         return res
@@ -0,0 +1,86 @@
+import json
+
+
+class LocalRegistry:
+    def __init__(self):
+        self.user_sids = {}
+        self.sid_users = {}
+        self.handler = None
+
+    def add(self, user_id, sid):
+        self.user_sids.setdefault(user_id, set()).add(sid)
+        self.sid_users[sid] = user_id
+
+    def remove(self, sid):
+        user_id = self.sid_users.pop(sid, None)
+        sids = self.user_sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.user_sids[user_id]
+        return user_id
+
+    def sids(self, user_id):
+        return list(self.user_sids.get(user_id, ()))
+
+    def count(self):
+        return len(self.sid_users)
+
+    def listen(self, handler, start_task=None):
+        self.handler = handler
+
+    def publish(self, command, sid, room):
+        if self.handler:
+            self.handler(command, sid, room)
+
+
+class RedisRegistry:
+    prefix = 'mrsh:sockets'
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.channel = f'{self.prefix}:rooms'
+
+    def add(self, user_id, sid):
+        pipe = self.redis.pipeline()
+        pipe.sadd(f'{self.prefix}:user:{user_id}', sid)
+        pipe.set(f'{self.prefix}:sid:{sid}', user_id)
+        pipe.incr(f'{self.prefix}:count')
+        pipe.execute()
+
+    def remove(self, sid):
+        user_id = self.redis.get(f'{self.prefix}:sid:{sid}')
+        if user_id is None:
+            return None
+        pipe = self.redis.pipeline()
+        pipe.srem(f'{self.prefix}:user:{user_id}', sid)
+        pipe.delete(f'{self.prefix}:sid:{sid}')
+        pipe.decr(f'{self.prefix}:count')
+        pipe.execute()
+        return int(user_id)
+
+    def sids(self, user_id):
+        return list(self.redis.smembers(f'{self.prefix}:user:{user_id}'))
+
+    def count(self):
+        return int(self.redis.get(f'{self.prefix}:count') or 0)
+
+    def listen(self, handler, start_task):
+        def _listen():
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            for message in pubsub.listen():
+                payload = json.loads(message['data'])
+                handler(payload['command'], payload['sid'], payload['room'])
+
+        start_task(_listen)
+
+    def publish(self, command, sid, room):
+        self.redis.publish(self.channel, json.dumps({'command': command, 'sid': sid, 'room': room}))
+
+
+def create_registry(url=None):
+    if url:
+        return RedisRegistry(url)
+    return LocalRegistry()
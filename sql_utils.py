@@ -1,9 +1,14 @@
 import os
+from contextlib import contextmanager
+from time import monotonic
 
 import pymysql
+from gevent.lock import BoundedSemaphore
+from gevent.queue import LifoQueue, Empty
 
 from credentials import secrets
 from constants import *
+from metrics import *
 
 dev = os.getenv('PRODUCTION') != 'true'
 
@@ -13,16 +18,133 @@ config = {'host': sql_host, 'user': secrets['sql_user'], 'password': secrets['sq
           'cursorclass': pymysql.cursors.DictCursor}
 
 
-def sql_req(query, *params, fetch_one=False, fetch_all=False, last_row_id=False):
-    conn = pymysql.connect(**config)
-    cur = conn.cursor()
-    cur.execute(query, params)
-    if fetch_one:
-        return cur.fetchone()
-    elif fetch_all:
-        return cur.fetchall()
-    elif last_row_id:
-        return cur.lastrowid
+class ConnectionPool:
+    def __init__(self, max_size=SQL_POOL_SIZE, timeout=SQL_POOL_TIMEOUT, recycle=SQL_POOL_RECYCLE, ping_interval=SQL_POOL_PING_INTERVAL, **kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.kwargs = kwargs
+        self._idle = LifoQueue()
+        self._slots = BoundedSemaphore(max_size)
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def _connect(self):
+        conn = pymysql.connect(**self.kwargs)
+        conn.created_at = conn.used_at = monotonic()
+        self.created += 1
+        return conn
+
+    def _close(self, conn):
+        self.closed += 1
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+    def _healthy(self, conn):
+        now = monotonic()
+        if self.recycle and now - conn.created_at > self.recycle:
+            return False
+        if self.ping_interval and now - conn.used_at > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except pymysql.err.Error:
+                return False
+        return True
+
+    def get(self):
+        if not self._slots.acquire(blocking=False):
+            self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                self.timeouts += 1
+                raise PoolTimeout(max(1, round(self.timeout)))
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    conn = self._idle.get_nowait()
+                except Empty:
+                    conn = self._connect()
+                    break
+                if not self._healthy(conn):
+                    self._close(conn)
+                    conn = None
+        except BaseException:
+            self._slots.release()
+            raise
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return conn
+
+    def put(self, conn, discard=False):
+        self.in_use -= 1
+        if discard or not conn.open:
+            self._close(conn)
+        else:
+            conn.used_at = monotonic()
+            self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.get()
+        try:
+            yield conn
+        except (pymysql.err.IntegrityError, pymysql.err.ProgrammingError, pymysql.err.DataError):
+            self.put(conn)
+            raise
+        except BaseException:
+            self.put(conn, discard=True)
+            raise
+        else:
+            self.put(conn)
+
+    @property
+    def stats(self):
+        return {
+            'max_size': self.max_size,
+            'idle': self._idle.qsize(),
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+            'created': self.created,
+            'closed': self.closed,
+        }
+
+
+pool = ConnectionPool(**config)
+
+Gauge('mrsh_sql_pool_in_use', 'SQL connections checked out.', lambda: pool.in_use)
+Gauge('mrsh_sql_pool_idle', 'Idle SQL connections.', lambda: pool._idle.qsize())
+Gauge('mrsh_sql_pool_max_size', 'SQL connection pool size.', lambda: pool.max_size)
+CallbackCounter('mrsh_sql_pool_waits_total', 'Checkouts that had to wait for a free connection.', lambda: pool.waits)
+CallbackCounter('mrsh_sql_pool_timeouts_total', 'Checkouts that timed out.', lambda: pool.timeouts)
+
+
+def sql_req(query, *params, fetch_one=False, fetch_all=False, last_row_id=False, row_count=False):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            start = monotonic()
+            cur.execute(query, params)
+            count_sql_query(monotonic() - start)
+            if fetch_one:
+                return cur.fetchone()
+            elif fetch_all:
+                return cur.fetchall()
+            elif last_row_id:
+                return cur.lastrowid
+            elif row_count:
+                return cur.rowcount
 
 
 def sql_insert(table, last_row_id=False, **values):
@@ -0,0 +1,102 @@
+import socket
+from types import SimpleNamespace
+
+import flask_mail
+import pytest
+from flask import Flask
+
+import mail
+from constants import *
+
+Controller = pytest.importorskip('aiosmtpd.controller').Controller
+
+
+class Sink:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def sink():
+    handler = Sink()
+    controller = Controller(handler, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield SimpleNamespace(handler=handler, port=controller.port)
+    controller.stop()
+
+
+@pytest.fixture
+def outbox(monkeypatch, sink):
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=sink.port, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+    mail.mail.init_app(app)
+    state = SimpleNamespace(app=app, batches=[], sent=[], failed=[], messages=sink.handler.messages)
+
+    def sql_req(query, *params, **kwargs):
+        if "status='sent'" in query:
+            state.sent.append(params[0])
+        else:
+            status, attempts, error, delay, email_id = params
+            state.failed.append({'id': email_id, 'status': status, 'attempts': attempts, 'delay': delay})
+
+    monkeypatch.setattr(mail, 'sql_req', sql_req)
+    monkeypatch.setattr(mail, '_claim_batch', lambda: state.batches.pop(0) if state.batches else [])
+    monkeypatch.setattr(mail, 'deliverable', lambda target: True)
+    with app.app_context():
+        yield state
+
+
+def _email(email_id, attempts=0):
+    return {'id': email_id, 'recipient': f'user{email_id}@example.com', 'subject': 'Subject', 'body': 'Body', 'attempts': attempts}
+
+
+def test_drain_outbox_delivers_to_sink(outbox):
+    outbox.batches.append([_email(1), _email(2)])
+    mail.drain_outbox()
+    assert outbox.sent == [1, 2]
+    assert outbox.failed == []
+    assert [message.rcpt_tos for message in outbox.messages] == [['user1@example.com'], ['user2@example.com']]
+
+
+def test_connection_drop_requeues_only_unsent(outbox, monkeypatch):
+    send = flask_mail.Connection.send
+    calls = []
+
+    def flaky_send(self, message, *args, **kwargs):
+        calls.append(message)
+        if len(calls) == 2:
+            raise ConnectionResetError('Connection reset by peer')
+        return send(self, message, *args, **kwargs)
+
+    monkeypatch.setattr(flask_mail.Connection, 'send', flaky_send)
+    outbox.batches.append([_email(1), _email(2), _email(3)])
+    mail.drain_outbox()
+    assert outbox.sent == [1]
+    assert [email['id'] for email in outbox.failed] == [2, 3]
+    assert all(email['status'] == 'pending' and email['attempts'] == 1 for email in outbox.failed)
+    assert len(outbox.messages) == 1
+
+
+def test_failed_send_backs_off_exponentially(outbox):
+    outbox.batches.append([_email(1, attempts=2)])
+    outbox.app.extensions['mail'].port = _free_port()
+    mail.drain_outbox()
+    assert outbox.failed == [{'id': 1, 'status': 'pending', 'attempts': 3, 'delay': MAIL_RETRY_DELAY * 2 ** 3}]
+
+
+def test_gives_up_after_max_attempts(outbox):
+    outbox.batches.append([_email(1, attempts=MAIL_MAX_ATTEMPTS - 1)])
+    outbox.app.extensions['mail'].port = _free_port()
+    mail.drain_outbox()
+    assert outbox.failed[0]['status'] == 'failed'
+    assert outbox.failed[0]['attempts'] == MAIL_MAX_ATTEMPTS
@@ -3,10 +3,33 @@ from flask_socketio import SocketIO, send, ConnectionRefusedError, join_room, le
 
 import mrsh_json
 from objects import *
+from registry import *
 
-socketio = SocketIO(path=f'/{APP_NAME}/websocket', json=mrsh_json, cors_allowed_origins='*', async_mode='gevent')
+socketio = SocketIO(path=f'/{APP_NAME}/websocket', json=mrsh_json, cors_allowed_origins='*', async_mode='gevent',
+                    message_queue=SOCKETIO_MESSAGE_QUEUE)
 
-socketio.clients = {}
+socketio.clients = create_registry(SOCKETIO_MESSAGE_QUEUE)
+socketio.local_sids = {}
+
+
+def _room_command(command, sid, room):
+    if sid not in socketio.local_sids:
+        return
+    if command == 'join':
+        socketio.server.enter_room(sid, room, namespace='/')
+    else:
+        socketio.server.leave_room(sid, room, namespace='/')
+
+
+socketio.clients.listen(_room_command, socketio.start_background_task)
+
+Gauge('mrsh_websocket_connections', 'Connected websocket clients across all workers.', lambda: socketio.clients.count())
+Gauge('mrsh_websocket_local_connections', 'Websocket clients connected to this worker.', lambda: len(socketio.local_sids))
+
+
+def _emit(event, *args, **kwargs):
+    emitted_events.inc(event)
+    socketio.emit(event, *args, **kwargs)
 
 
 def validate_token():
@@ -24,38 +47,61 @@ def validate_token():
 @socketio.event
 def connect():
     user = validate_token()
-    if user.id not in socketio.clients:
-        socketio.clients[user.id] = []
-    socketio.clients[user.id].append(request.sid)
-    for chat in user.get_chats():
-        join_room(f'chat{chat.id}')
+    socketio.local_sids[request.sid] = user.id
+    socketio.clients.add(user.id, request.sid)
+    join_room(f'user{user.id}')
+    for chat_id in user.get_chat_ids(WEBSOCKET_SUBSCRIBE_RECENT):
+        join_room(f'chat{chat_id}')
     send({'status': 'connected', 'response': user})
 
 
 @socketio.event
 def disconnect():
-    for user in socketio.clients:
-        if request.sid in socketio.clients[user]:
-            socketio.clients[user].remove(request.sid)
+    user_id = socketio.local_sids.pop(request.sid, None)
+    socketio.clients.remove(request.sid)
+    if user_id is not None:
+        read_markers.flush(user_id)
+
+
+def _subscription_callback(subscribe):
+    def _inner(kwargs=None):
+        try:
+            if not isinstance(kwargs, dict):
+                raise BadArgumentType('peer_id')
+            try:
+                chat = Chat.get(int(kwargs.get('peer_id')))
+            except (TypeError, ValueError):
+                raise BadArgumentType('peer_id')
+            if subscribe:
+                chat.assess_access(socketio.local_sids[request.sid])
+        except InvalidRequest as e:
+            return {'success': False, 'error': error_response(e)}
+        (join_room if subscribe else leave_room)(f'chat{chat.id}')
+        return {'success': True, 'response': {'peer_id': chat.id}}
+
+    return _inner
+
+
+socketio.on_event('subscribe', _subscription_callback(True))
+socketio.on_event('unsubscribe', _subscription_callback(False))
 
 
 def _join_chat(user_id, chat_id):
-    for sid in socketio.clients.get(user_id, []):
-        join_room(f'chat{chat_id}', sid=sid, namespace='/')
+    for sid in socketio.clients.sids(user_id):
+        socketio.clients.publish('join', sid, f'chat{chat_id}')
 
 
 def _leave_chat(user_id, chat_id):
-    for sid in socketio.clients.get(user_id, []):
-        leave_room(f'chat{chat_id}', sid=sid, namespace='/')
+    for sid in socketio.clients.sids(user_id):
+        socketio.clients.publish('leave', sid, f'chat{chat_id}')
 
 
-def _emit_to_user(user_id, *args, **kwargs):
-    for sid in socketio.clients.get(user_id, []):
-        socketio.emit(*args, room=sid, **kwargs)
+def _emit_to_user(user_id, event, *args, **kwargs):
+    _emit(event, *args, room=f'user{user_id}', **kwargs)
 
 
 def send_message_to_chat(chat_id, message):
-    socketio.emit('new_message', message, room=f'chat{chat_id}')
+    _emit('new_message', message, room=f'chat{chat_id}')
 
 
 def invite_to_chat(chat, user, last_message):
@@ -67,7 +113,7 @@ def invite_to_chat(chat, user, last_message):
 
 
 def removed_from_chat(chat, user):
-    _leave_chat(chat, user)
+    _leave_chat(user, chat.id)
     _emit_to_user(user, 'chat_removed', chat)
 
 
@@ -84,4 +130,8 @@ def change_settings(user, changed):
 
 
 def read_message(message):
-    socketio.emit('message_read', message, room=f'chat{message.chat_id}')
+    _emit('message_read', message, room=f'chat{message.chat_id}')
+
+
+def read_state(user_id, chat_id, last_read, unread):
+    _emit_to_user(user_id, 'read_state', {'chat_id': chat_id, 'last_read': last_read, 'unread': unread})